@@ -0,0 +1,133 @@
+"""Benchmarks of the collectors and handlers on the hot paths
+
+Run from the repository root:
+
+    python -m benchmarks                 # run and compare with the baseline
+    python -m benchmarks --save          # run and store a new baseline
+    python -m benchmarks -k todo -k links --min-time 0.2
+
+Everything runs against stand-ins: a fixture /proc and /sys tree, a fake
+Docker Engine API socket, a fresh database per size and local HTTP servers
+posing as monitored devices. Exits with status 1 when a benchmark is slower
+than its baseline by more than --threshold (--micro-threshold below 1ms),
+measured against a reference workload timed in each of its --repeats
+rounds, and by more than the noise seen between those rounds.
+"""
+
+import argparse
+import asyncio
+import importlib
+import os
+import shutil
+import sys
+import tempfile
+from .harness import (
+    find_regressions,
+    load_baseline,
+    measure,
+    print_header,
+    print_result,
+    save_baseline,
+)
+
+SUITES = ("hardware", "docker", "storage", "services")
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+
+def integers(value: str):
+    return [int(part) for part in value.split(",")]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    parser.add_argument(
+        "-k",
+        dest="patterns",
+        action="append",
+        default=[],
+        help="only run benchmarks whose name contains this text",
+    )
+    parser.add_argument("--min-time", type=float, default=1.0)
+    parser.add_argument(
+        "--repeats",
+        type=int,
+        default=5,
+        help="rounds per benchmark, whose spread sets the noise margin",
+    )
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save", action="store_true", help="store a new baseline")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.25,
+        help="allowed p50 slowdown against the baseline, 0.25 is 25%%",
+    )
+    parser.add_argument(
+        "--micro-threshold",
+        type=float,
+        default=1.0,
+        help="allowed p50 slowdown of benchmarks faster than 1ms",
+    )
+    parser.add_argument(
+        "--alloc-threshold",
+        type=float,
+        default=0.5,
+        help="allowed peak allocation growth against the baseline",
+    )
+    parser.add_argument("--sizes", type=integers, default=[10, 1000, 10000])
+    parser.add_argument("--hosts", type=integers, default=[1, 8, 32])
+    parser.add_argument("--containers", type=int, default=20)
+    return parser.parse_args()
+
+
+async def run(args, workdir: str, baseline: dict):
+    from plugins.http_client import close_session
+
+    results = []
+    print_header()
+    try:
+        for suite in SUITES:
+            module = importlib.import_module(f"{__package__}.bench_{suite}")
+            async for case in module.cases(workdir, args):
+                if args.patterns and not any(p in case.name for p in args.patterns):
+                    continue
+                result = await measure(
+                    case, min_time=args.min_time, repeats=args.repeats
+                )
+                print_result(result, baseline.get(result.name))
+                results.append(result)
+    finally:
+        await close_session()
+    return results
+
+
+def main():
+    args = parse_args()
+    workdir = tempfile.mkdtemp(prefix="home-dashboard-bench-")
+    # The plugins read DATA_DIR on import, so it is set before loading them
+    os.environ["DATA_DIR"] = os.path.join(workdir, "data")
+    baseline = load_baseline(args.baseline)
+
+    try:
+        results = asyncio.run(run(args, workdir, baseline))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    regressions = find_regressions(
+        results,
+        baseline,
+        args.threshold,
+        args.alloc_threshold,
+        micro_threshold=args.micro_threshold,
+    )
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+
+    if args.save:
+        save_baseline(args.baseline, results, baseline)
+        print(f"Saved baseline to {args.baseline}")
+    elif regressions:
+        sys.exit(1)
+
+
+main()
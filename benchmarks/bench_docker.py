@@ -0,0 +1,58 @@
+import os
+import aiohttp
+from microdot import Microdot
+from plugins import procfs
+from plugins.docker import DockerPlugin
+from .fixtures import build_proc_tree, container_ids, docker_engine, serve
+from .harness import Case
+
+
+async def cases(workdir: str, options):
+    ids = container_ids(options.containers)
+    proc, sys = build_proc_tree(workdir, ids)
+    roots = procfs.PROC_ROOT, procfs.SYS_ROOT
+    procfs.PROC_ROOT, procfs.SYS_ROOT = proc, sys
+    socket_path = os.path.join(workdir, "docker.sock")
+    count = len(ids)
+
+    try:
+        async with serve(docker_engine(ids), socket_path):
+            docker = DockerPlugin(Microdot())
+            # The same session DockerPlugin.run() opens on a real socket
+            docker.session = aiohttp.ClientSession(
+                connector=aiohttp.UnixConnector(path=socket_path),
+                base_url="http://docker",
+            )
+            try:
+                await docker._load_containers()
+                running = [
+                    container_id
+                    for container_id, container in docker.containers.items()
+                    if container["running"]
+                ]
+                event = {
+                    "Action": "restart",
+                    "Actor": {"ID": ids[0], "Attributes": {"name": "container-0"}},
+                }
+
+                yield Case(f"docker.load_containers[{count}]", docker._load_containers)
+                yield Case(
+                    f"docker.read_all_cgroups[{count}]",
+                    lambda: docker._read_all_cgroups(running),
+                )
+                # A cold lookup walks the cgroup patterns again
+                yield Case(
+                    f"docker.read_all_cgroups_cold[{count}]",
+                    lambda: docker._read_all_cgroups(running),
+                    before=docker.cgroups.clear,
+                )
+                yield Case(
+                    "docker.fetch_api_counters",
+                    lambda: docker._fetch_api_counters(ids[0]),
+                )
+                yield Case("docker.apply_event", lambda: docker._apply_event(event))
+                yield Case(f"docker.get_containers[{count}]", docker.get_containers)
+            finally:
+                await docker.session.close()
+    finally:
+        procfs.PROC_ROOT, procfs.SYS_ROOT = roots
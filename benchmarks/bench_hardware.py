@@ -0,0 +1,25 @@
+from plugins import hardware, procfs
+from .fixtures import build_proc_tree
+from .harness import Case
+
+
+async def cases(workdir: str, options):
+    proc, sys = build_proc_tree(workdir, [])
+    roots = procfs.PROC_ROOT, procfs.SYS_ROOT
+    procfs.PROC_ROOT, procfs.SYS_ROOT = proc, sys
+    try:
+        before = hardware.read_all_cpu_stats()
+        after = {cpu: [n + 5 for n in values] for cpu, values in before.items()}
+
+        yield Case("hardware.get_uptime_seconds", hardware.get_uptime_seconds)
+        yield Case("hardware.get_ram_bytes", hardware.get_ram_bytes)
+        yield Case("hardware.read_thermal_zone", hardware.read_thermal_zone)
+        yield Case("hardware.read_all_cpu_stats", hardware.read_all_cpu_stats)
+        yield Case(
+            "hardware.calculate_idle_percent",
+            lambda: hardware.calculate_idle_percent(before, after),
+        )
+        yield Case("hardware.get_used_and_total_disk", hardware.get_used_and_total_disk)
+        yield Case("hardware.hardware_info", hardware.hardware_info)
+    finally:
+        procfs.PROC_ROOT, procfs.SYS_ROOT = roots
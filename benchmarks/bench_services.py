@@ -0,0 +1,35 @@
+from contextlib import AsyncExitStack
+from microdot import Microdot
+from plugins.service import ServicePlugin
+from plugins.storage import database
+from .fixtures import request, reset_database, serve, services_host
+from .harness import Case
+
+UNITS_PER_HOST = 60
+
+
+async def cases(workdir: str, options):
+    for count in options.hosts:
+        async with AsyncExitStack() as stack:
+            hosts = [
+                await stack.enter_async_context(serve(services_host(UNITS_PER_HOST)))
+                for _ in range(count)
+            ]
+            reset_database()
+            with database() as db:
+                db.table("monitored_devices").insert_multiple(
+                    {"hostname": host} for host in hosts
+                )
+            services = ServicePlugin(Microdot())
+
+            # Every call goes to all hosts, as with ?bust=true
+            yield Case(
+                f"services.fetch_all[{count}]",
+                lambda: services.fetch_all_services(refresh=True),
+            )
+            yield Case(
+                f"services.get_all_cached[{count}]",
+                lambda: services.handle_get_all_services(request()),
+            )
+
+    reset_database()
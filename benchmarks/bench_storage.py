@@ -0,0 +1,75 @@
+import random
+from datetime import datetime
+from microdot import Microdot
+from plugins.links import RANK_GAP, LinkPlugin
+from plugins.storage import database
+from plugins.todo import TodoListPlugin
+from .fixtures import request, reset_database
+from .harness import Case
+
+
+def seed(size: int):
+    """Fill the todos and links tables the way the handlers write them"""
+    now = datetime.now().isoformat()
+    with database() as db:
+        db.table("todos").insert_multiple(
+            {
+                "content": "" if n % 10 == 9 else f"Todo number {n}",
+                "created_at": now,
+                "updated_at": now,
+                "revision": n + 1,
+                # Every tenth todo is a tombstone left by a delete
+                **({"deleted": True} if n % 10 == 9 else {}),
+            }
+            for n in range(size)
+        )
+        db.table("links").insert_multiple(
+            {
+                "url": f"https://example.com/{n}",
+                "name": f"Link {n}",
+                "icon": f"https://example.com/{n}/favicon.ico",
+                "icon_file": f"{n:064x}",
+                "icon_type": "image/x-icon",
+                "order": (n + 1) * RANK_GAP,
+            }
+            for n in range(size)
+        )
+
+
+async def cases(workdir: str, options):
+    app = Microdot()
+    todos = TodoListPlugin(app)
+    links = LinkPlugin(app)
+
+    for size in options.sizes:
+        reset_database()
+        seed(size)
+        rng = random.Random(size)
+        live_ids = [id for id in range(1, size + 1) if id % 10]
+        since = max(size - 50, 0)
+
+        yield Case(f"todo.get[{size}]", lambda: todos.get_todos(request()))
+        yield Case(
+            f"todo.get_since[{size}]",
+            lambda: todos.get_todos(request({"since": str(since)})),
+        )
+        yield Case(
+            f"todo.patch[{size}]",
+            lambda: todos.patch_todo(
+                request(json={"content": "Changed"}), str(rng.choice(live_ids))
+            ),
+        )
+        yield Case(f"links.get[{size}]", lambda: links.get_links(request()))
+        yield Case(
+            f"links.reorder[{size}]",
+            lambda: links.reorder_links(
+                request(
+                    json={
+                        "id": rng.randint(1, size),
+                        "index": rng.randint(0, size - 1),
+                    }
+                )
+            ),
+        )
+
+    reset_database()
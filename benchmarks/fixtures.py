@@ -0,0 +1,241 @@
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+from aiohttp import web
+from plugins import storage
+
+CPU_CORES = 8
+CONTAINER_PID = 4242
+
+MEMINFO = """MemTotal:        8038232 kB
+MemFree:          612340 kB
+MemAvailable:    5627412 kB
+Buffers:          236112 kB
+Cached:          4612220 kB
+SwapCached:            0 kB
+Active:          3318524 kB
+Inactive:        3428832 kB
+SwapTotal:       2097148 kB
+SwapFree:        2097148 kB
+Dirty:               188 kB
+Shmem:             61852 kB
+Slab:             406640 kB
+"""
+
+NET_DEV = """Inter-|   Receive                            |  Transmit
+ face |bytes    packets errs drop fifo frame compressed multicast|bytes    packets errs drop fifo colls carrier compressed
+    lo:  123456     100    0    0    0     0          0         0   123456     100    0    0    0     0       0          0
+  eth0: 98765432   65432    0    0    0     0          0         0 12345678   23456    0    0    0     0       0          0
+"""
+
+
+def write(path: str, content: str):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(content)
+
+
+def build_proc_tree(root: str, container_ids: list[str]):
+    """Write a /proc and /sys tree shaped like a small ARM or x86 server
+
+    Returns the (proc, sys) roots to point `procfs` at.
+    """
+    proc = os.path.join(root, "proc")
+    sys = os.path.join(root, "sys")
+
+    write(f"{proc}/uptime", "350423.57 2693871.20\n")
+    write(f"{proc}/meminfo", MEMINFO)
+
+    stat = [f"cpu  {' '.join(str(n * CPU_CORES) for n in range(10, 20))}"]
+    stat += [
+        f"cpu{core} {' '.join(str(n + core) for n in range(10, 20))}"
+        for core in range(CPU_CORES)
+    ]
+    stat += ["intr 1234567 0 0", "ctxt 7654321", "btime 1700000000", "processes 9999"]
+    write(f"{proc}/stat", "\n".join(stat) + "\n")
+
+    # Real mounts next to the pseudo filesystems `df` skips
+    mounts = [
+        "/dev/root / ext4 rw,noatime 0 0",
+        f"/dev/sda1 {root} ext4 rw,relatime 0 0",
+        "/dev/mmcblk0p1 /boot/firmware vfat rw 0 0",
+        "proc /proc proc rw 0 0",
+        "sysfs /sys sysfs rw 0 0",
+        "devtmpfs /dev devtmpfs rw 0 0",
+        "tmpfs /run tmpfs rw 0 0",
+        "tmpfs /dev/shm tmpfs rw 0 0",
+        "cgroup2 /sys/fs/cgroup cgroup2 rw 0 0",
+    ]
+    mounts += [
+        f"overlay /var/lib/docker/overlay2/{container_id}/merged overlay rw 0 0"
+        for container_id in container_ids
+    ]
+    mounts += [
+        f"/dev/loop{n} /snap/core/{n} squashfs ro 0 0" for n in range(len(mounts))
+    ]
+    write(f"{proc}/mounts", "\n".join(mounts) + "\n")
+
+    write(f"{sys}/class/thermal/thermal_zone0/type", "acpitz\n")
+    write(f"{sys}/class/thermal/thermal_zone0/temp", "27800\n")
+    write(f"{sys}/class/thermal/thermal_zone1/type", "x86_pkg_temp\n")
+    write(f"{sys}/class/thermal/thermal_zone1/temp", "45000\n")
+
+    write(f"{proc}/{CONTAINER_PID}/net/dev", NET_DEV)
+    for container_id in container_ids:
+        cgroup = f"{sys}/fs/cgroup/system.slice/docker-{container_id}.scope"
+        write(
+            f"{cgroup}/cpu.stat", "usage_usec 123456789\nuser_usec 1\nsystem_usec 2\n"
+        )
+        write(f"{cgroup}/memory.current", "73400320\n")
+        write(f"{cgroup}/memory.max", "max\n")
+        write(f"{cgroup}/io.stat", "179:0 rbytes=1024000 wbytes=2048000 rios=10\n")
+        write(f"{cgroup}/cgroup.procs", f"{CONTAINER_PID}\n")
+
+    return proc, sys
+
+
+def container_ids(count: int):
+    return [f"{n:064x}" for n in range(1, count + 1)]
+
+
+def docker_engine(ids: list[str]):
+    """Engine API stand-in answering the calls DockerPlugin makes"""
+    containers = [
+        {
+            "Id": container_id,
+            "Names": [f"/container-{n}"],
+            "Image": f"example/image-{n}:latest",
+            "State": "running" if n % 4 else "exited",
+        }
+        for n, container_id in enumerate(ids)
+    ]
+    stats = {
+        "cpu_stats": {"cpu_usage": {"total_usage": 123456789000}},
+        "memory_stats": {"usage": 73400320, "limit": 8231239680},
+        "networks": {"eth0": {"rx_bytes": 98765432, "tx_bytes": 12345678}},
+        "blkio_stats": {
+            "io_service_bytes_recursive": [
+                {"major": 179, "minor": 0, "op": "read", "value": 1024000},
+                {"major": 179, "minor": 0, "op": "write", "value": 2048000},
+            ]
+        },
+    }
+
+    async def list_containers(request: web.Request):
+        return web.json_response(containers)
+
+    async def events(request: web.Request):
+        # Keep the stream open without events, like an idle engine
+        response = web.StreamResponse()
+        response.content_type = "application/json"
+        await response.prepare(request)
+        await asyncio.sleep(3600)
+        return response
+
+    async def container_stats(request: web.Request):
+        return web.json_response(stats)
+
+    app = web.Application()
+    app.router.add_get("/events", events)
+    app.router.add_get("/containers/json", list_containers)
+    app.router.add_get("/containers/{id}/stats", container_stats)
+    return app
+
+
+def services_host(count: int):
+    """Stand-in for the /api/services endpoint of a monitored device"""
+    units = [
+        {
+            "name": f"unit-{n}.service",
+            "state": "active" if n % 7 else "failed",
+            "sub_state": "running" if n % 7 else "failed",
+            "description": f"Example unit number {n}",
+        }
+        for n in range(count)
+    ]
+
+    async def get_services(request: web.Request):
+        return web.json_response(units)
+
+    app = web.Application()
+    app.router.add_get("/api/services", get_services)
+    return app
+
+
+def weather_api():
+    """OpenWeatherMap stand-in for the current weather and geocoding calls"""
+
+    async def current_weather(request: web.Request):
+        lat = float(request.query["lat"])
+        return web.json_response(
+            {
+                "id": int(abs(lat) * 1000),
+                "main": {"temp": round(lat % 30, 1)},
+                "weather": [{"description": "scattered clouds"}],
+            }
+        )
+
+    async def geocode(request: web.Request):
+        name = request.query["q"]
+        return web.json_response(
+            [{"name": name, "country": "PL", "lat": len(name), "lon": 19.9}]
+        )
+
+    app = web.Application()
+    app.router.add_get("/data/2.5/weather", current_weather)
+    app.router.add_get("/geo/1.0/direct", geocode)
+    return app
+
+
+def text_host(text: str):
+    """Answer every GET with `text`, like the external IP providers"""
+
+    async def get_text(request: web.Request):
+        return web.Response(text=text)
+
+    app = web.Application()
+    app.router.add_get("/{path:.*}", get_text)
+    return app
+
+
+@asynccontextmanager
+async def serve(app: web.Application, path: str | None = None):
+    """Serve `app` on a unix socket at `path`, or on a free local TCP port
+
+    Yields the socket path or the `host:port` to reach it at.
+    """
+    runner = web.AppRunner(app, access_log=None, shutdown_timeout=0.1)
+    await runner.setup()
+    try:
+        if path is not None:
+            site = web.UnixSite(runner, path)
+            await site.start()
+            yield path
+        else:
+            site = web.TCPSite(runner, "127.0.0.1", 0)
+            await site.start()
+            yield f"127.0.0.1:{runner.addresses[0][1]}"
+    finally:
+        await runner.cleanup()
+
+
+def reset_database():
+    """Drop the shared database so the next `database()` starts empty"""
+    db = storage._db
+    if isinstance(db, storage.SQLiteDB):
+        db.connection.close()
+    elif db is not None:
+        db.close()
+    storage._db = None
+    for path in (storage.DB_PATH, storage.SQLITE_PATH):
+        for suffix in ("", "-wal", "-shm"):
+            try:
+                os.remove(path + suffix)
+            except FileNotFoundError:
+                pass
+
+
+def request(args: dict | None = None, json=None):
+    """The parts of a microdot Request the handlers read"""
+    return SimpleNamespace(args=args or {}, json=json)
@@ -0,0 +1,229 @@
+import gc
+import json
+import statistics
+import time
+import tracemalloc
+from dataclasses import dataclass, asdict
+from inspect import isawaitable
+from typing import Callable
+
+
+@dataclass
+class Case:
+    name: str
+    func: Callable
+    # Runs before every call, outside of the measurement
+    before: Callable | None = None
+
+
+@dataclass
+class Result:
+    name: str
+    iterations: int
+    ops_per_sec: float
+    p50_us: float
+    p95_us: float
+    p99_us: float
+    peak_alloc_bytes: int
+    retained_bytes: int
+    # Median of the fastest round in units of the reference workload timed
+    # next to it, and the interquartile range of that ratio over all rounds
+    relative_p50: float = 0.0
+    relative_spread: float = 0.0
+
+
+def percentile(sorted_values: list[float], q: float):
+    index = min(len(sorted_values) - 1, max(0, round(q * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+async def call(case: Case):
+    if case.before is not None:
+        case.before()
+    started = time.perf_counter()
+    result = case.func()
+    if isawaitable(result):
+        await result
+    return time.perf_counter() - started
+
+
+def reference():
+    """Fixed pure Python work, to tell a slower machine from slower code"""
+    return sorted(str(n) for n in range(1000))
+
+
+def time_reference(iterations=20):
+    durations = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        reference()
+        durations.append(time.perf_counter() - started)
+    return statistics.median(durations)
+
+
+def spread(values: list[float]):
+    if len(values) < 2:
+        return 0.0
+    q1, _, q3 = statistics.quantiles(values, n=4, method="inclusive")
+    return q3 - q1
+
+
+async def measure(
+    case: Case, min_time=1.0, max_iterations=100_000, warmup=5, repeats=5
+):
+    """Time `case` for at least `min_time` seconds, then trace its allocations
+
+    The time is split into `repeats` rounds, each timed together with the
+    reference workload, so a machine that slows down for a while (CPU steal,
+    frequency scaling) moves both. Allocations are traced in a separate,
+    shorter pass because tracemalloc slows every allocation down and would
+    skew the latencies.
+    """
+    for _ in range(warmup):
+        await call(case)
+
+    durations = []
+    ratios = []
+    for _ in range(repeats):
+        gc.collect()
+        reference_time = time_reference()
+        round_durations = []
+        deadline = time.perf_counter() + min_time / repeats
+        while len(round_durations) < max_iterations // repeats and (
+            len(round_durations) < 10 or time.perf_counter() < deadline
+        ):
+            round_durations.append(await call(case))
+        reference_time = (reference_time + time_reference()) / 2
+        ratios.append(statistics.median(round_durations) / reference_time)
+        durations += round_durations
+
+    alloc_iterations = max(3, min(len(durations) // 10, 200))
+    peaks = []
+    gc.collect()
+    tracemalloc.start()
+    try:
+        start, _ = tracemalloc.get_traced_memory()
+        for _ in range(alloc_iterations):
+            tracemalloc.reset_peak()
+            current, _ = tracemalloc.get_traced_memory()
+            await call(case)
+            _, peak = tracemalloc.get_traced_memory()
+            peaks.append(peak - current)
+        gc.collect()
+        end, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    durations.sort()
+    return Result(
+        name=case.name,
+        iterations=len(durations),
+        ops_per_sec=round(len(durations) / sum(durations), 1),
+        p50_us=round(percentile(durations, 0.5) * 1e6, 1),
+        p95_us=round(percentile(durations, 0.95) * 1e6, 1),
+        p99_us=round(percentile(durations, 0.99) * 1e6, 1),
+        peak_alloc_bytes=round(statistics.median(peaks)),
+        retained_bytes=max(0, round((end - start) / alloc_iterations)),
+        relative_p50=round(min(ratios), 3),
+        relative_spread=round(spread(ratios), 3),
+    )
+
+
+def format_bytes(size: float):
+    for unit in ("B", "KiB", "MiB"):
+        if abs(size) < 1024 or unit == "MiB":
+            return f"{size:.0f}{unit}" if unit == "B" else f"{size:.1f}{unit}"
+        size /= 1024
+
+
+def print_result(result: Result, baseline: Result | None = None):
+    change = ""
+    if baseline is not None and baseline.p50_us:
+        change = f"{(result.p50_us / baseline.p50_us - 1) * 100:+6.1f}%"
+    print(
+        f"{result.name:<44} {result.ops_per_sec:>11.1f}/s"
+        f" {result.p50_us:>10.1f} {result.p95_us:>10.1f} {result.p99_us:>10.1f}"
+        f" {format_bytes(result.peak_alloc_bytes):>10}"
+        f" {format_bytes(result.retained_bytes):>9} {change}",
+        flush=True,
+    )
+
+
+def print_header():
+    print(
+        f"{'benchmark':<44} {'throughput':>13} {'p50 us':>10} {'p95 us':>10}"
+        f" {'p99 us':>10} {'peak alloc':>10} {'retained':>9} vs baseline"
+    )
+
+
+def load_baseline(path: str):
+    try:
+        with open(path, "r") as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return {}
+    return {name: Result(**result) for name, result in data["results"].items()}
+
+
+def save_baseline(path: str, results: list[Result], merge: dict[str, Result]):
+    """Store the results, keeping baseline entries of benchmarks not run"""
+    merged = {**merge, **{result.name: result for result in results}}
+    with open(path, "w") as f:
+        json.dump(
+            {"results": {name: asdict(result) for name, result in merged.items()}},
+            f,
+            indent=2,
+            sort_keys=True,
+        )
+        f.write("\n")
+
+
+def find_regressions(
+    results: list[Result],
+    baseline: dict[str, Result],
+    threshold: float,
+    alloc_threshold: float,
+    alloc_floor=1024,
+    noise_factor=3.0,
+    micro_threshold=1.0,
+    micro_us=1000,
+):
+    """Return a message for every benchmark slower or hungrier than allowed
+
+    Latency is compared on the median of the fastest round relative to the
+    reference workload, which a machine that is slower for a while does not
+    move. The slowdown also has to exceed `noise_factor` times the larger
+    spread between rounds, so benchmarks that jitter are not flagged.
+    Benchmarks faster than `micro_us` are held to `micro_threshold` instead,
+    since a few cache misses or a syscall move them by tens of percent.
+    Allocations below `alloc_floor` bytes are too small to compare.
+    """
+    regressions = []
+    for result in results:
+        previous = baseline.get(result.name)
+        if previous is None:
+            continue
+        if previous.relative_p50:
+            before, after = previous.relative_p50, result.relative_p50
+            noise = noise_factor * max(previous.relative_spread, result.relative_spread)
+        else:
+            before, after, noise = previous.p50_us, result.p50_us, 0
+        allowed = threshold
+        if previous.p50_us < micro_us:
+            allowed = max(threshold, micro_threshold)
+        if before and after - before > max(before * allowed, noise):
+            regressions.append(
+                f"{result.name}: p50 {previous.p50_us}us -> {result.p50_us}us"
+                f" ({(after / before - 1) * 100:+.0f}% relative to the reference)"
+            )
+        if max(
+            previous.peak_alloc_bytes, result.peak_alloc_bytes
+        ) >= alloc_floor and result.peak_alloc_bytes > previous.peak_alloc_bytes * (
+            1 + alloc_threshold
+        ):
+            regressions.append(
+                f"{result.name}: peak allocation"
+                f" {format_bytes(previous.peak_alloc_bytes)}"
+                f" -> {format_bytes(result.peak_alloc_bytes)}"
+            )
+    return regressions
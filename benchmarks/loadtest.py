@@ -0,0 +1,563 @@
+"""Load test of server.py with many dashboard clients
+
+Run from the repository root:
+
+    python -m benchmarks.loadtest --clients 1,10,50,100 --output run.json
+    python -m benchmarks.loadtest --compare run.json
+
+Starts server.py on a fresh database, with stand-ins for the monitored
+devices, Docker, OpenWeatherMap and the external IP providers, then ramps up
+virtual clients. Each client polls like the frontend in src/api: the whole
+page is loaded once, /api/status every 5 seconds, and the other queries again
+every --refresh seconds, the way switching back to a kiosk tab refetches them.
+
+Reported per step and over time: throughput, latency percentiles per
+endpoint, event loop lag of the server (from /api/debug/timings) and its
+RSS. The stand-ins and the clients share one process, so watch the
+"client lag" column: when it grows, the load generator is the bottleneck.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from contextlib import AsyncExitStack
+import aiohttp
+from plugins.timings import BUCKETS, Histogram
+from .fixtures import (
+    container_ids,
+    docker_engine,
+    serve,
+    services_host,
+    text_host,
+    weather_api,
+)
+from .harness import percentile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# refetchInterval of useStatus in src/api/status.ts
+STATUS_INTERVAL = 5.0
+# Parallel connections a browser opens to one host
+CONNECTIONS_PER_CLIENT = 6
+REQUEST_TIMEOUT = 30.0
+PAGE_QUERIES = (
+    "weather",
+    "link",
+    "todos",
+    "services/pinned",
+    "services/all",
+    "monitored_devices",
+)
+
+
+def seed_database(data_dir: str, devices: list[str], rows: int):
+    """Write a db.json with every migration applied and `rows` todos/links"""
+    migrations = sorted(
+        name
+        for name in os.listdir(os.path.join(ROOT, "migrations"))
+        if name[0].isdigit() and name.endswith(".py")
+    )
+    now = "2026-01-01T12:00:00"
+    tables = {
+        "migrations": [{"name": name} for name in migrations],
+        "monitored_devices": [{"hostname": device} for device in devices],
+        "pinned_services": [
+            {"name": "unit-1.service", "host": device} for device in devices
+        ],
+        "weather_cities": [
+            {
+                "id": None,
+                "name": f"City {n}",
+                "country": "PL",
+                "state": None,
+                "lat": 50.0 + n,
+                "lon": 19.9,
+            }
+            for n in range(5)
+        ],
+        "links": [
+            {
+                "url": f"https://example.com/{n}",
+                "name": f"Link {n}",
+                "icon": None,
+                "icon_checked": True,
+                "order": (n + 1) * 1024,
+            }
+            for n in range(rows)
+        ],
+        "todos": [
+            {
+                "content": f"Todo number {n}",
+                "created_at": now,
+                "updated_at": now,
+                "revision": n + 1,
+            }
+            for n in range(rows)
+        ],
+    }
+    os.makedirs(data_dir, exist_ok=True)
+    with open(os.path.join(data_dir, "db.json"), "w") as f:
+        json.dump(
+            {
+                table: {str(id): doc for id, doc in enumerate(docs, start=1)}
+                for table, docs in tables.items()
+            },
+            f,
+        )
+
+
+class Recorder:
+    def __init__(self):
+        # (finished at, endpoint, seconds, ok)
+        self.samples: list[tuple[float, str, float, bool]] = []
+
+    def add(self, endpoint: str, seconds: float, ok: bool):
+        self.samples.append((time.monotonic(), endpoint, seconds, ok))
+
+    def between(self, start: float, end: float):
+        return [sample for sample in self.samples if start <= sample[0] < end]
+
+
+class VirtualClient:
+    """One dashboard tab, polling with the intervals of the frontend"""
+
+    def __init__(self, base_url: str, recorder: Recorder, rng: random.Random, args):
+        self.base_url = base_url
+        self.recorder = recorder
+        self.rng = rng
+        self.refresh = args.refresh
+        self.todos_cursor = 0
+        self.inflight: dict[str, asyncio.Task] = {}
+
+    async def fetch(self, session: aiohttp.ClientSession, endpoint: str, path: str):
+        started = time.monotonic()
+        try:
+            async with session.get(f"/api/{path}") as response:
+                body = await response.read()
+                ok = response.status < 400
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            body, ok = None, False
+        self.recorder.add(endpoint, time.monotonic() - started, ok)
+        return body if ok else None
+
+    async def fetch_todos(self, session: aiohttp.ClientSession):
+        # Delta sync like syncTodos in src/api/todo.ts
+        more = True
+        while more:
+            body = await self.fetch(
+                session, "todos", f"todos?since={self.todos_cursor}"
+            )
+            if body is None:
+                return
+            changes = json.loads(body)
+            self.todos_cursor = changes["cursor"]
+            more = changes["more"]
+
+    def query(self, session: aiohttp.ClientSession, name: str):
+        """Start a query unless it is still running, as react-query does"""
+        task = self.inflight.get(name)
+        if task is not None and not task.done():
+            return
+        if name == "todos":
+            coroutine = self.fetch_todos(session)
+        else:
+            coroutine = self.fetch(session, name, name)
+        self.inflight[name] = asyncio.create_task(coroutine)
+
+    async def run(self):
+        connector = aiohttp.TCPConnector(limit=CONNECTIONS_PER_CLIENT)
+        async with aiohttp.ClientSession(
+            self.base_url,
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT),
+        ) as session:
+            try:
+                # Tabs are not opened in lockstep
+                await asyncio.sleep(self.rng.uniform(0, STATUS_INTERVAL))
+                next_refresh = time.monotonic()
+                while True:
+                    self.query(session, "status")
+                    if time.monotonic() >= next_refresh:
+                        for name in PAGE_QUERIES:
+                            self.query(session, name)
+                        next_refresh += self.refresh
+                    await asyncio.sleep(STATUS_INTERVAL)
+            finally:
+                for task in self.inflight.values():
+                    task.cancel()
+
+
+def read_rss(pid: int):
+    """Resident set size of `pid` in bytes"""
+    try:
+        with open(f"/proc/{pid}/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except FileNotFoundError:
+        pass
+    return None
+
+
+def interval_lag(before: dict | None, after: dict | None):
+    """Loop lag summary of the samples taken between two timings snapshots"""
+    if after is None:
+        return None
+    counts = [
+        count - (before["counts"][index] if before else 0)
+        for index, count in enumerate(after["counts"])
+    ]
+    if not any(counts):
+        return None
+
+    histogram = Histogram()
+    histogram.counts = counts
+    histogram.count = sum(counts)
+    histogram.total = (after["total_ms"] - (before["total_ms"] if before else 0)) / 1000
+    # The maximum inside the interval is unknown; bound it by the highest
+    # bucket that got samples
+    highest = max(index for index, count in enumerate(counts) if count)
+    histogram.max = (
+        after["max_ms"] / 1000 if highest == len(BUCKETS) else BUCKETS[highest]
+    )
+    return histogram.summary()
+
+
+class Monitor:
+    """Sample the server's loop lag and RSS every `interval` seconds"""
+
+    def __init__(self, base_url: str, pid: int, interval: float):
+        self.base_url = base_url
+        self.pid = pid
+        self.interval = interval
+        self.lag: dict | None = None
+        self.samples: list[dict] = []
+
+    async def snapshot(self, session: aiohttp.ClientSession):
+        try:
+            async with session.get("/api/debug/timings?buckets=true") as response:
+                timings = await response.json()
+            return timings["timings"].get("loop.lag")
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError, KeyError):
+            return None
+
+    async def run(self, recorder: Recorder, clients: list):
+        async with aiohttp.ClientSession(
+            self.base_url, timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+        ) as session:
+            started = time.monotonic()
+            self.lag = await self.snapshot(session)
+            while True:
+                tick = time.monotonic()
+                await asyncio.sleep(self.interval)
+                now = time.monotonic()
+                lag = await self.snapshot(session)
+                samples = recorder.between(now - self.interval, now)
+                status = sorted(s[2] for s in samples if s[1] == "status")
+                lag_summary = interval_lag(self.lag, lag)
+                self.lag = lag or self.lag
+                self.samples.append(
+                    {
+                        "t": round(now - started, 1),
+                        "clients": len(clients),
+                        "rps": round(len(samples) / self.interval, 1),
+                        "errors": sum(1 for s in samples if not s[3]),
+                        "status_p95_ms": (
+                            round(percentile(status, 0.95) * 1000, 1)
+                            if status
+                            else None
+                        ),
+                        "loop_lag_p99_ms": lag_summary and lag_summary["p99_ms"],
+                        "rss_mb": round((read_rss(self.pid) or 0) / 2**20, 1),
+                        "client_lag_ms": round(
+                            max(now - tick - self.interval, 0) * 1000, 1
+                        ),
+                    }
+                )
+                print_sample(self.samples[-1])
+
+
+def endpoint_summary(samples: list):
+    durations = sorted(s[2] for s in samples)
+    return {
+        "requests": len(samples),
+        "errors": sum(1 for s in samples if not s[3]),
+        "p50_ms": round(percentile(durations, 0.5) * 1000, 1),
+        "p95_ms": round(percentile(durations, 0.95) * 1000, 1),
+        "p99_ms": round(percentile(durations, 0.99) * 1000, 1),
+        "max_ms": round(durations[-1] * 1000, 1),
+    }
+
+
+def step_summary(clients: int, samples: list, duration: float, lag, rss: list):
+    endpoints = {}
+    for sample in samples:
+        endpoints.setdefault(sample[1], []).append(sample)
+    return {
+        "clients": clients,
+        "requests": len(samples),
+        "rps": round(len(samples) / duration, 1),
+        "errors": sum(1 for s in samples if not s[3]),
+        "endpoints": {
+            name: endpoint_summary(endpoints[name]) for name in sorted(endpoints)
+        },
+        "loop_lag": lag,
+        "rss_mb": {
+            "end": rss[-1] if rss else None,
+            "max": max(rss) if rss else None,
+        },
+    }
+
+
+def print_sample(sample: dict):
+    print(
+        f"  t={sample['t']:>6}s clients={sample['clients']:<4}"
+        f" {sample['rps']:>7}/s errors={sample['errors']:<4}"
+        f" status p95={sample['status_p95_ms']}ms"
+        f" loop lag p99={sample['loop_lag_p99_ms']}ms"
+        f" rss={sample['rss_mb']}MB client lag={sample['client_lag_ms']}ms",
+        flush=True,
+    )
+
+
+def print_steps(steps: list, previous: list | None = None):
+    previous = {step["clients"]: step for step in previous or []}
+    print(
+        f"\n{'clients':>7} {'req/s':>8} {'errors':>6} {'status p50':>10}"
+        f" {'p95':>8} {'p99':>8} {'loop lag p99':>12} {'rss MB':>7}"
+    )
+    for step in steps:
+        status = step["endpoints"].get("status")
+        lag = step["loop_lag"] or {}
+        print(
+            f"{step['clients']:>7} {step['rps']:>8} {step['errors']:>6}"
+            f" {status['p50_ms'] if status else '-':>10}"
+            f" {status['p95_ms'] if status else '-':>8}"
+            f" {status['p99_ms'] if status else '-':>8}"
+            f" {lag.get('p99_ms', '-'):>12} {step['rss_mb']['max']:>7}"
+        )
+        before = previous.get(step["clients"])
+        if before:
+            print(f"{'':>7} {compare_steps(before, step)}")
+
+    print("\nPer endpoint (ms, p50/p95/p99):")
+    for step in steps:
+        print(
+            f"{step['clients']:>7} "
+            + "  ".join(
+                f"{name} {e['p50_ms']}/{e['p95_ms']}/{e['p99_ms']}"
+                for name, e in step["endpoints"].items()
+            )
+        )
+
+
+def compare_steps(before: dict, after: dict):
+    def change(old, new):
+        if not old or new is None:
+            return "n/a"
+        return f"{(new / old - 1) * 100:+.0f}%"
+
+    status_before = before["endpoints"].get("status", {})
+    status_after = after["endpoints"].get("status", {})
+    lag_before = before["loop_lag"] or {}
+    lag_after = after["loop_lag"] or {}
+    changes = {
+        "req/s": change(before["rps"], after["rps"]),
+        "status p95": change(status_before.get("p95_ms"), status_after.get("p95_ms")),
+        "p99": change(status_before.get("p99_ms"), status_after.get("p99_ms")),
+        "loop lag p99": change(lag_before.get("p99_ms"), lag_after.get("p99_ms")),
+        "rss": change(before["rss_mb"]["max"], after["rss_mb"]["max"]),
+    }
+    return "vs previous: " + ", ".join(f"{k} {v}" for k, v in changes.items())
+
+
+async def wait_for_server(base_url: str, process, timeout=60.0):
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession(base_url) as session:
+        while time.monotonic() < deadline:
+            if process.returncode is not None:
+                raise RuntimeError("server.py exited during startup")
+            try:
+                async with session.get("/api/status") as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError("server.py did not start in time")
+
+
+async def run(args, workdir: str):
+    async with AsyncExitStack() as stack:
+        devices = [
+            await stack.enter_async_context(serve(services_host(60)))
+            for _ in range(args.devices)
+        ]
+        docker_socket = os.path.join(workdir, "docker.sock")
+        await stack.enter_async_context(
+            serve(docker_engine(container_ids(args.containers)), docker_socket)
+        )
+        weather = await stack.enter_async_context(serve(weather_api()))
+        external_ip = await stack.enter_async_context(serve(text_host("203.0.113.7")))
+
+        data_dir = os.path.join(workdir, "data")
+        seed_database(data_dir, devices, args.rows)
+        log = open(os.path.join(workdir, "server.log"), "w")
+        stack.callback(log.close)
+        process = await asyncio.create_subprocess_exec(
+            sys.executable,
+            "server.py",
+            cwd=ROOT,
+            stdout=log,
+            stderr=log,
+            env={
+                **os.environ,
+                "PORT": str(args.port),
+                "DATA_DIR": data_dir,
+                "DOCKER_HOST": f"unix://{docker_socket}",
+                "OPENWEATHERMAP_API_KEY": "loadtest",
+                "OPENWEATHERMAP_URL": f"http://{weather}",
+                "EXTERNAL_IP_PROVIDERS": f"http://{external_ip}/",
+            },
+        )
+        base_url = f"http://127.0.0.1:{args.port}"
+        try:
+            await wait_for_server(base_url, process)
+            return await ramp(args, base_url, process.pid)
+        finally:
+            if process.returncode is None:
+                process.terminate()
+                try:
+                    await asyncio.wait_for(process.wait(), 10)
+                except asyncio.TimeoutError:
+                    process.kill()
+                    await process.wait()
+
+
+async def ramp(args, base_url: str, pid: int):
+    recorder = Recorder()
+    rng = random.Random(args.seed)
+    clients: list[asyncio.Task] = []
+    monitor = Monitor(base_url, pid, args.sample_interval)
+    monitor_task = asyncio.create_task(monitor.run(recorder, clients))
+    steps = []
+
+    try:
+        for target in args.clients:
+            print(f"Ramping to {target} clients", flush=True)
+            while len(clients) < target:
+                client = VirtualClient(base_url, recorder, rng, args)
+                clients.append(asyncio.create_task(client.run()))
+
+            started = time.monotonic()
+            lag_before = monitor.lag
+            samples_before = len(monitor.samples)
+            await asyncio.sleep(args.step_duration)
+            ended = time.monotonic()
+            steps.append(
+                step_summary(
+                    target,
+                    recorder.between(started, ended),
+                    ended - started,
+                    interval_lag(lag_before, monitor.lag),
+                    [s["rss_mb"] for s in monitor.samples[samples_before:]],
+                )
+            )
+    finally:
+        for task in [monitor_task, *clients]:
+            task.cancel()
+        await asyncio.gather(monitor_task, *clients, return_exceptions=True)
+
+    return {"steps": steps, "timeline": monitor.samples}
+
+
+def integers(value: str):
+    return [int(part) for part in value.split(",")]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.loadtest")
+    parser.add_argument(
+        "--clients",
+        type=integers,
+        default=[1, 10, 25, 50, 100, 200],
+        help="comma separated client counts to ramp through",
+    )
+    parser.add_argument("--step-duration", type=float, default=30.0)
+    parser.add_argument(
+        "--refresh",
+        type=float,
+        default=60.0,
+        help="seconds between refetches of the queries other than status",
+    )
+    parser.add_argument("--sample-interval", type=float, default=STATUS_INTERVAL)
+    parser.add_argument("--devices", type=int, default=4)
+    parser.add_argument("--containers", type=int, default=10)
+    parser.add_argument("--rows", type=int, default=50, help="todos and links")
+    parser.add_argument("--port", type=int, default=18746)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write the results as JSON")
+    parser.add_argument("--compare", help="JSON results of an earlier run")
+    parser.add_argument(
+        "--slo-ms",
+        type=float,
+        default=1000.0,
+        help="status p95 a step must stay under to count as served",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    config = {
+        key: getattr(args, key)
+        for key in (
+            "clients",
+            "step_duration",
+            "refresh",
+            "devices",
+            "containers",
+            "rows",
+            "seed",
+        )
+    }
+
+    previous = None
+    if args.compare:
+        with open(args.compare, "r") as f:
+            previous = json.load(f)
+        if previous["config"] != config:
+            print(f"Warning: {args.compare} was run with {previous['config']}")
+
+    workdir = tempfile.mkdtemp(prefix="home-dashboard-load-")
+    try:
+        results = asyncio.run(run(args, workdir))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print_steps(results["steps"], previous and previous["steps"])
+    served = [
+        step["clients"]
+        for step in results["steps"]
+        if step["endpoints"].get("status")
+        and step["endpoints"]["status"]["p95_ms"] <= args.slo_ms
+        and not step["errors"]
+    ]
+    print(
+        f"\nMost clients with status p95 under {args.slo_ms:g}ms and no errors:"
+        f" {max(served) if served else 'none'}"
+    )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"config": config, **results}, f, indent=2)
+            f.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,9 @@
 from datetime import datetime
-from tinydb import TinyDB
+from plugins.storage import database
 
 
 def apply():
-    with TinyDB("data/db.json") as db:
+    with database() as db:
         table = db.table("todos")
         all_todos = table.all()
 
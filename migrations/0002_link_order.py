@@ -1,8 +1,8 @@
-from tinydb import TinyDB
+from plugins.storage import database
 
 
 def apply():
-    with TinyDB("data/db.json") as db:
+    with database() as db:
         table = db.table("links")
         all_links = table.all()
 
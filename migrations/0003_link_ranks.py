@@ -0,0 +1,14 @@
+from plugins.storage import database
+from plugins.links import RANK_GAP
+
+
+def apply():
+    with database() as db:
+        table = db.table("links")
+        all_links = table.all(order_by="order")
+
+        for index, link in enumerate(all_links):
+            table.update({"order": (index + 1) * RANK_GAP}, doc_ids=[link.doc_id])
+
+
+apply()
@@ -0,0 +1,16 @@
+from plugins.storage import database
+
+
+def apply():
+    with database() as db:
+        table = db.table("todos")
+        all_todos = table.all()
+
+        for index, todo in enumerate(all_todos):
+            table.update(
+                {"updated_at": todo["created_at"], "revision": index + 1},
+                doc_ids=[todo.doc_id],
+            )
+
+
+apply()
@@ -1,27 +1,47 @@
 import os
 import re
-from tinydb import TinyDB
+from plugins.storage import database, flush_database, get_meta, set_meta
+
+
+def get_migration_files():
+    return sorted(f for f in os.listdir("migrations") if re.match(r"[0-9]+_.*\.py", f))
+
+
+def get_schema_version(migration_files):
+    return "\n".join(migration_files)
+
+
+def read_schema_version():
+    with database() as db:
+        return get_meta(db, "schema_version")
+
+
+def write_schema_version(version):
+    with database() as db:
+        set_meta(db, "schema_version", version)
 
 
 def get_applied_migrations():
-    with TinyDB("data/db.json") as db:
+    with database() as db:
         table = db.table("migrations")
         applied = table.all()
         return {m["name"] for m in applied}
 
 
 def mark_migration_as_applied(name):
-    with TinyDB("data/db.json") as db:
+    with database() as db:
         table = db.table("migrations")
         table.insert({"name": name})
 
 
 def run_migrations():
-    applied_migrations = get_applied_migrations()
-    migration_files = sorted(
-        f for f in os.listdir("migrations") if re.match(r"[0-9]+_.*\.py", f)
-    )
+    migration_files = get_migration_files()
+    version = get_schema_version(migration_files)
+    # Kept in the database itself, so a restored copy brings its own version
+    if read_schema_version() == version:
+        return
 
+    applied_migrations = get_applied_migrations()
     for migration_file in migration_files:
         if migration_file in applied_migrations:
             continue
@@ -33,3 +53,6 @@ def run_migrations():
 
         mark_migration_as_applied(migration_file)
         print(f"Applied migration: {migration_file}")
+
+    write_schema_version(version)
+    flush_database()
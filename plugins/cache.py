@@ -0,0 +1,97 @@
+import asyncio
+import time
+from collections import OrderedDict
+from functools import partial
+from .concurrency import SingleFlight
+from . import timings
+
+
+class CacheEntry:
+    __slots__ = ("value", "loaded_at", "error")
+
+    def __init__(self, value, loaded_at: float):
+        self.value = value
+        self.loaded_at = loaded_at
+        self.error = None
+
+    def age(self):
+        return time.monotonic() - self.loaded_at
+
+
+class AsyncTTLCache:
+    """Size-bounded TTL cache for coroutine results
+
+    Entries younger than `ttl` are served as is; within the last
+    `refresh_ahead` seconds of that window a background refresh is started.
+    For `stale_ttl` seconds after expiry the old entry is still served while
+    a refresh runs (stale-while-revalidate), and if a refresh fails any old
+    entry is served with its `error` set (stale-if-error). Concurrent loads
+    of the same key share one call to the loader.
+    """
+
+    def __init__(
+        self, ttl: float, stale_ttl=0.0, maxsize=128, refresh_ahead=0.0, name=None
+    ):
+        self.name = name
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.maxsize = maxsize
+        self.refresh_ahead = refresh_ahead
+        self.entries: OrderedDict = OrderedDict()
+        self.loading = SingleFlight()
+
+    def count(self, event: str):
+        if self.name is not None:
+            timings.count(f"cache.{self.name}", event)
+
+    def is_stale(self, entry: CacheEntry):
+        return entry.error is not None or entry.age() >= self.ttl
+
+    async def get(self, key, loader) -> CacheEntry:
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            age = entry.age()
+            if age < self.ttl:
+                if self.refresh_ahead and age >= self.ttl - self.refresh_ahead:
+                    self.refresh(key, loader)
+                self.count("hits")
+                return entry
+            if age < self.ttl + self.stale_ttl:
+                self.refresh(key, loader)
+                self.count("stale")
+                return entry
+
+        self.count("misses")
+        try:
+            return await asyncio.shield(self.refresh(key, loader))
+        except Exception:
+            if entry is not None:
+                return entry
+            raise
+
+    def refresh(self, key, loader):
+        """Start loading `key` unless a load is already running"""
+        return self.loading.start(key, partial(self._run_loader, key, loader))
+
+    async def _run_loader(self, key, loader):
+        try:
+            value = await loader()
+        except Exception as e:
+            entry = self.entries.get(key)
+            if entry is not None:
+                entry.error = str(e) or e.__class__.__name__
+            raise
+
+        entry = CacheEntry(value, time.monotonic())
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+        return entry
+
+    def invalidate(self, key=None):
+        if key is None:
+            self.entries.clear()
+        else:
+            self.entries.pop(key, None)
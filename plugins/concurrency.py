@@ -0,0 +1,86 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, wraps
+from inspect import iscoroutinefunction
+from microdot import Microdot
+
+BLOCKING_WORKERS = int(os.getenv("BLOCKING_WORKERS", 8))
+# Most workers a single endpoint may occupy, so one slow handler cannot
+# starve the others
+ROUTE_CONCURRENCY = max(1, BLOCKING_WORKERS // 2)
+
+executor = ThreadPoolExecutor(
+    max_workers=BLOCKING_WORKERS, thread_name_prefix="blocking"
+)
+
+
+class SingleFlight:
+    """Share one in-flight call between concurrent callers of the same key"""
+
+    def __init__(self):
+        self.tasks: dict[object, asyncio.Task] = {}
+
+    def start(self, key, func) -> asyncio.Task:
+        """Start `func()` for `key` unless it is already running"""
+        task = self.tasks.get(key)
+        if task is None:
+            task = asyncio.create_task(func())
+            task.add_done_callback(lambda t: self._done(key, t))
+            self.tasks[key] = task
+        return task
+
+    def _done(self, key, task: asyncio.Task):
+        if self.tasks.get(key) is task:
+            del self.tasks[key]
+        # Nobody may be waiting any more, so consume the exception here to
+        # keep asyncio from reporting it as unhandled
+        if not task.cancelled():
+            task.exception()
+
+    async def run(self, key, func):
+        # A caller going away must not cancel the call for the others
+        return await asyncio.shield(self.start(key, func))
+
+
+async def run_blocking(func, *args, **kwargs):
+    """Run a blocking function on the bounded worker pool"""
+    return await asyncio.get_running_loop().run_in_executor(
+        executor, partial(func, *args, **kwargs)
+    )
+
+
+def limit_concurrency(handler, limit: int):
+    """Wrap a handler so at most `limit` calls of it run at once
+
+    Sync handlers wait for their turn on the event loop and then run on the
+    worker pool, so waiting requests do not hold a thread.
+    """
+    semaphore = asyncio.Semaphore(limit)
+
+    @wraps(handler)
+    async def limited(*args, **kwargs):
+        async with semaphore:
+            if iscoroutinefunction(handler):
+                return await handler(*args, **kwargs)
+            return await run_blocking(handler, *args, **kwargs)
+
+    return limited
+
+
+def install(app: Microdot, limit=ROUTE_CONCURRENCY):
+    """Give every sync route its own concurrency limit on the worker pool
+
+    Call once all routes are registered. The loop's default executor is left
+    alone, so sync request hooks and asyncio.to_thread() never queue behind
+    busy routes.
+    """
+    for index, (methods, pattern, handler, prefix, subapp) in enumerate(app.url_map):
+        if not iscoroutinefunction(handler):
+            app.url_map[index] = (
+                methods,
+                pattern,
+                limit_concurrency(handler, limit),
+                prefix,
+                subapp,
+            )
@@ -1,66 +1,421 @@
-import subprocess
+import asyncio
 import json
+import os
+import shutil
+import time
+import aiohttp
 from microdot import Request
+from . import procfs
+
+DOCKER_SOCKETS = [
+    "/var/run/docker.sock",
+    "/run/docker.sock",
+    "/run/podman/podman.sock",
+]
+
+# Where cgroup v2 puts a container, for the systemd and cgroupfs drivers
+CGROUP_PATTERNS = [
+    "system.slice/docker-{id}.scope",
+    "docker/{id}",
+    "machine.slice/libpod-{id}.scope",
+    "system.slice/nerdctl-{id}.scope",
+    "default/{id}",
+]
+
+ENGINES = ("docker", "nerdctl")
+# Seconds between looks for an engine on hosts that have none
+PROBE_INTERVAL = 60
+
+RUNNING_ACTIONS = {"start", "restart", "unpause"}
+STOPPED_ACTIONS = {"create", "die", "stop", "pause"}
+
+
+def read_cgroup_counters(cgroup: str):
+    """Return raw usage counters of a container from its cgroup v2 files"""
+    with open(f"{cgroup}/cpu.stat", "r") as f:
+        cpu_usec = next(
+            int(line.split()[1]) for line in f if line.startswith("usage_usec")
+        )
+    with open(f"{cgroup}/memory.current", "r") as f:
+        memory_usage = int(f.read())
+    with open(f"{cgroup}/memory.max", "r") as f:
+        limit = f.read().strip()
+        memory_limit = None if limit == "max" else int(limit)
+
+    block_read = block_write = 0
+    try:
+        with open(f"{cgroup}/io.stat", "r") as f:
+            for line in f:
+                for field in line.split()[1:]:
+                    key, _, value = field.partition("=")
+                    if key == "rbytes":
+                        block_read += int(value)
+                    elif key == "wbytes":
+                        block_write += int(value)
+    except FileNotFoundError:
+        pass
+
+    # Network counters are per namespace, so read them through any process
+    # of the container; this needs the host PID namespace
+    network_rx = network_tx = 0
+    with open(f"{cgroup}/cgroup.procs", "r") as f:
+        pid = f.readline().strip()
+    try:
+        if pid:
+            with open(f"{procfs.PROC_ROOT}/{pid}/net/dev", "r") as f:
+                for line in f.readlines()[2:]:
+                    interface, _, values = line.partition(":")
+                    if interface.strip() == "lo":
+                        continue
+                    values = values.split()
+                    network_rx += int(values[0])
+                    network_tx += int(values[8])
+    except FileNotFoundError:
+        # The process exited, or runs in a PID namespace we cannot see
+        pass
+
+    return {
+        "cpu_usec": cpu_usec,
+        "memory_usage": memory_usage,
+        "memory_limit": memory_limit,
+        "network_rx": network_rx,
+        "network_tx": network_tx,
+        "block_read": block_read,
+        "block_write": block_write,
+    }
+
+
+def parse_api_stats(stats: dict):
+    """Return the counters of read_cgroup_counters() from an Engine API
+    /containers/<id>/stats document"""
+    networks = (stats.get("networks") or {}).values()
+    block_io = (stats.get("blkio_stats") or {}).get("io_service_bytes_recursive") or []
+    memory = stats.get("memory_stats") or {}
+
+    return {
+        "cpu_usec": stats["cpu_stats"]["cpu_usage"]["total_usage"] // 1000,
+        "memory_usage": memory.get("usage", 0),
+        "memory_limit": memory.get("limit"),
+        "network_rx": sum(n.get("rx_bytes", 0) for n in networks),
+        "network_tx": sum(n.get("tx_bytes", 0) for n in networks),
+        "block_read": sum(
+            e["value"] for e in block_io if e.get("op", "").lower() == "read"
+        ),
+        "block_write": sum(
+            e["value"] for e in block_io if e.get("op", "").lower() == "write"
+        ),
+    }
+
+
+def find_engine():
+    """Return the first container engine CLI on PATH, without running it"""
+    return next((engine for engine in ENGINES if shutil.which(engine)), None)
+
+
+def find_socket():
+    docker_host = os.getenv("DOCKER_HOST", "")
+    if docker_host.startswith("unix://"):
+        return docker_host[len("unix://") :]
+
+    for path in DOCKER_SOCKETS:
+        if os.path.exists(path):
+            return path
+    return None
 
 
 class DockerPlugin:
     engine = "docker"
 
     def __init__(self, app):
-        try:
-            subprocess.run(
-                ["docker", "version"],
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.DEVNULL,
-            )
-        except FileNotFoundError:
-            self.engine = "nerdctl"
+        self.containers: dict[str, dict] = {}
+        self.stats: dict[str, dict] = {}
+        self.counters: dict[str, tuple[float, dict]] = {}
+        self.cgroups: dict[str, str | None] = {}
+        self.socket_path = find_socket()
+        self.session: aiohttp.ClientSession | None = None
         app.post("/api/docker/<container_id>/start")(self.start_container)
         app.post("/api/docker/<container_id>/stop")(self.stop_container)
         app.post("/api/docker/<container_id>/restart")(self.restart_container)
 
-    def _run_command(self, action: str, container_id: str):
+    async def run(self, interval=5.0):
+        """Keep the container table in sync with the engine
+
+        With an Engine API socket the table is loaded once and then patched
+        from the /events stream. Engines without one (nerdctl) are polled
+        through the CLI every `interval` seconds instead. Without either,
+        the host is checked again every PROBE_INTERVAL seconds.
+        """
+        engine = None
+        while not self.socket_path:
+            engine = find_engine()
+            if engine:
+                break
+            await asyncio.sleep(PROBE_INTERVAL)
+            self.socket_path = find_socket()
+
+        if self.socket_path:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.UnixConnector(path=self.socket_path),
+                base_url="http://docker",
+                timeout=aiohttp.ClientTimeout(total=None, sock_connect=3),
+            )
+            try:
+                await self._watch_events(interval)
+            finally:
+                await self.session.close()
+                self.session = None
+        else:
+            self.engine = engine
+            await self._poll_cli(interval)
+
+    async def _watch_events(self, retry_interval: float):
+        filters = json.dumps({"type": ["container"]})
+        while True:
+            try:
+                async with self.session.get(
+                    "/events", params={"filters": filters}
+                ) as response:
+                    response.raise_for_status()
+                    # Listing only after the stream is open means no event
+                    # can slip in between the snapshot and the first update
+                    await self._load_containers()
+                    async for line in response.content:
+                        if line.strip():
+                            self._apply_event(json.loads(line))
+            except (aiohttp.ClientError, OSError, json.JSONDecodeError) as e:
+                print(f"Docker events stream failed: {e}")
+            except Exception as e:
+                # An unexpected document must not stop the watcher for good
+                print(f"Docker events stream failed: {e!r}")
+            await asyncio.sleep(retry_interval)
+
+    async def _load_containers(self):
+        async with self.session.get(
+            "/containers/json", params={"all": "1"}
+        ) as response:
+            response.raise_for_status()
+            containers = await response.json()
+
+        self.containers = {
+            container["Id"]: {
+                "running": container.get("State") == "running",
+                "image": container.get("Image"),
+                "id": container["Id"][:12],
+                "name": (container.get("Names") or [""])[0].lstrip("/"),
+            }
+            for container in containers
+        }
+
+    def _apply_event(self, event: dict):
+        action = event.get("Action", "")
+        actor = event.get("Actor", {})
+        container_id = actor.get("ID") or event.get("id")
+        attributes = actor.get("Attributes", {})
+        if not container_id:
+            return
+
+        if action == "destroy":
+            self.containers.pop(container_id, None)
+            return
+
+        if action not in RUNNING_ACTIONS | STOPPED_ACTIONS | {"rename"}:
+            return
+
+        container = self.containers.setdefault(
+            container_id,
+            {
+                "running": False,
+                "image": attributes.get("image"),
+                "id": container_id[:12],
+                "name": attributes.get("name"),
+            },
+        )
+        if "name" in attributes:
+            container["name"] = attributes["name"]
+        if action in RUNNING_ACTIONS:
+            container["running"] = True
+        elif action in STOPPED_ACTIONS:
+            container["running"] = False
+
+    async def _poll_cli(self, interval: float):
+        while True:
+            try:
+                process = await asyncio.create_subprocess_exec(
+                    self.engine,
+                    "ps",
+                    "-a",
+                    # Full IDs, which the cgroup paths are named after
+                    "--no-trunc",
+                    "--format",
+                    "json",
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.DEVNULL,
+                )
+                stdout, _ = await process.communicate()
+                containers = [json.loads(line) for line in stdout.splitlines()]
+
+                self.containers = {
+                    container.get("ID"): {
+                        "running": container.get("Status") == "Up"
+                        or container.get("State") == "running",
+                        "image": container.get("Image"),
+                        "id": container.get("ID", "")[:12],
+                        "name": container.get("Names"),
+                    }
+                    for container in containers
+                }
+            except (OSError, json.JSONDecodeError, KeyError):
+                self.containers = {}
+            await asyncio.sleep(interval)
+
+    async def _run_command(self, action: str, container_id: str):
+        if self.session:
+            try:
+                async with self.session.post(
+                    f"/containers/{container_id}/{action}",
+                    timeout=aiohttp.ClientTimeout(total=60),
+                ) as response:
+                    if response.status in (204, 304):
+                        return "", 204
+                    error = await response.json(content_type=None)
+                    return {"error": error.get("message", "")}, 500
+            except (aiohttp.ClientError, OSError, asyncio.TimeoutError) as e:
+                return {"error": str(e)}, 500
+
         try:
-            result = subprocess.run(
-                [self.engine, action, container_id],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
+            process = await asyncio.create_subprocess_exec(
+                self.engine,
+                action,
+                container_id,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
             )
-            if result.returncode == 0:
+            _, stderr = await process.communicate()
+            if process.returncode == 0:
                 return "", 204
-            return {"error": result.stderr.strip()}, 500
+            return {"error": stderr.decode().strip()}, 500
         except OSError as e:
             return {"error": str(e)}, 500
 
-    def start_container(self, request: Request, container_id: str):
-        return self._run_command("start", container_id)
+    async def start_container(self, request: Request, container_id: str):
+        return await self._run_command("start", container_id)
 
-    def stop_container(self, request: Request, container_id: str):
-        return self._run_command("stop", container_id)
+    async def stop_container(self, request: Request, container_id: str):
+        return await self._run_command("stop", container_id)
 
-    def restart_container(self, request: Request, container_id: str):
-        return self._run_command("restart", container_id)
+    async def restart_container(self, request: Request, container_id: str):
+        return await self._run_command("restart", container_id)
 
-    def get_containers(self):
+    def _find_cgroup(self, container_id: str):
+        if container_id not in self.cgroups:
+            self.cgroups[container_id] = None
+            for pattern in CGROUP_PATTERNS:
+                path = f"{procfs.SYS_ROOT}/fs/cgroup/" + pattern.format(id=container_id)
+                if os.path.isdir(path):
+                    self.cgroups[container_id] = path
+                    break
+        return self.cgroups[container_id]
+
+    def _read_all_cgroups(self, container_ids: list[str]):
+        counters = {}
+        for container_id in container_ids:
+            cgroup = self._find_cgroup(container_id)
+            if cgroup is None:
+                continue
+            try:
+                counters[container_id] = read_cgroup_counters(cgroup)
+            except (OSError, ValueError, IndexError, StopIteration):
+                self.cgroups.pop(container_id, None)
+        return counters
+
+    async def _fetch_api_counters(self, container_id: str):
         try:
-            result = subprocess.run(
-                [self.engine, "ps", "-a", "--format", "json"],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-            ).stdout.splitlines()
-            containers = [json.loads(line) for line in result]
-
-            return [
-                {
-                    "running": container.get("Status") == "Up"
-                    or container.get("State") == "running",
-                    "image": container.get("Image"),
-                    "id": container.get("ID"),
-                    "name": container.get("Names"),
-                }
-                for container in containers
-            ]
-        except (OSError, json.JSONDecodeError, KeyError):
-            return []
+            async with self.session.get(
+                f"/containers/{container_id}/stats",
+                params={"stream": "false", "one-shot": "true"},
+                timeout=aiohttp.ClientTimeout(total=10),
+            ) as response:
+                response.raise_for_status()
+                return parse_api_stats(await response.json())
+        except (
+            aiohttp.ClientError,
+            OSError,
+            asyncio.TimeoutError,
+            KeyError,
+            TypeError,
+            ValueError,
+        ):
+            # ValueError covers a body that is not JSON at all
+            return None
+
+    async def sample_stats(self, interval=5.0):
+        """Collect resource usage of every running container in one pass
+
+        Counters come straight from the cgroup v2 files when the host
+        cgroup tree is visible, and from one concurrent round of one-shot
+        Engine API stats calls for the containers where it is not.
+        """
+        while True:
+            try:
+                await self.sample_once()
+            except Exception as e:
+                # Keep the previous stats and try again on the next pass
+                print(f"Could not sample container stats: {e!r}")
+            await asyncio.sleep(interval)
+
+    async def sample_once(self):
+        running = [
+            container_id
+            for container_id, container in self.containers.items()
+            if container["running"]
+        ]
+        counters = await asyncio.to_thread(self._read_all_cgroups, running)
+
+        missing = [c for c in running if c not in counters]
+        if missing and self.session:
+            results = await asyncio.gather(
+                *(self._fetch_api_counters(c) for c in missing)
+            )
+            for container_id, result in zip(missing, results):
+                if result is not None:
+                    counters[container_id] = result
+
+        now = time.monotonic()
+        stats = {}
+        for container_id, current in counters.items():
+            previous = self.counters.get(container_id)
+            stats[container_id] = {
+                "memory_usage": current["memory_usage"],
+                "memory_limit": current["memory_limit"],
+                "cpu_percent": None,
+                "network_rx_rate": None,
+                "network_tx_rate": None,
+                "block_read_rate": None,
+                "block_write_rate": None,
+            }
+            if previous is not None and now > previous[0]:
+                elapsed = now - previous[0]
+                before = previous[1]
+                stats[container_id]["cpu_percent"] = round(
+                    (current["cpu_usec"] - before["cpu_usec"]) / (elapsed * 1e6) * 100,
+                    2,
+                )
+                for key in (
+                    "network_rx",
+                    "network_tx",
+                    "block_read",
+                    "block_write",
+                ):
+                    stats[container_id][f"{key}_rate"] = round(
+                        max(current[key] - before[key], 0) / elapsed
+                    )
+
+        self.counters = {c: (now, counters[c]) for c in counters}
+        self.stats = stats
+        self.cgroups = {c: self.cgroups[c] for c in running if c in self.cgroups}
+
+    def get_containers(self):
+        return [
+            {**container, "stats": self.stats.get(container_id)}
+            for container_id, container in self.containers.items()
+        ]
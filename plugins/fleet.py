@@ -0,0 +1,182 @@
+import asyncio
+import time
+from functools import partial
+import aiohttp
+from microdot import Microdot, Request
+from .storage import database
+from .cache import AsyncTTLCache
+from .concurrency import run_blocking
+from .http_client import get_session
+from .network import get_hostname
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """Stop calling a host after `threshold` consecutive failures
+
+    After `reset_timeout` seconds a single trial request is let through; its
+    outcome closes the circuit again or keeps it open for another period.
+    """
+
+    def __init__(self, threshold=3, reset_timeout=30.0):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+
+    def allow(self):
+        if self.opened_at is None:
+            return True
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            # Let one trial through and keep the circuit open for the others
+            self.opened_at = time.monotonic()
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+
+
+class FleetClient:
+    """Fetch the same API path from every monitored device concurrently
+
+    Every host gets its own deadline, circuit breaker and cached last good
+    response, so one slow or dead host never holds up the others.
+    """
+
+    def __init__(
+        self, path: str, ttl=5.0, stale_ttl=300.0, timeout=3.0, refresh_ahead=0.0
+    ):
+        self.path = path
+        self.timeout = timeout
+        self.cache = AsyncTTLCache(
+            ttl=ttl,
+            stale_ttl=stale_ttl,
+            maxsize=256,
+            refresh_ahead=refresh_ahead,
+            name=f"fleet:{path}",
+        )
+        self.breakers: dict[str, CircuitBreaker] = {}
+        self.failures: dict[str, tuple[float, str]] = {}
+
+    async def fetch_host(self, hostname: str):
+        breaker = self.breakers.setdefault(hostname, CircuitBreaker())
+        try:
+            if not breaker.allow():
+                raise CircuitOpenError("Circuit open")
+            try:
+                async with get_session().get(
+                    f"http://{hostname}{self.path}",
+                    timeout=aiohttp.ClientTimeout(total=self.timeout),
+                ) as response:
+                    response.raise_for_status()
+                    data = await response.json()
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+                breaker.record_failure()
+                raise
+        except Exception as e:
+            self.failures[hostname] = (time.monotonic(), str(e) or e.__class__.__name__)
+            raise
+
+        breaker.record_success()
+        self.failures.pop(hostname, None)
+        return data
+
+    def unreachable(self, hostname: str, error: str):
+        return {
+            "hostname": hostname,
+            "status": "unreachable",
+            "age": None,
+            "error": error,
+            "data": None,
+        }
+
+    async def get_host(self, hostname: str, refresh=False):
+        loader = partial(self.fetch_host, hostname)
+
+        # A forced refresh replaces the cached response only if it succeeds
+        if refresh:
+            try:
+                await asyncio.shield(self.cache.refresh(hostname, loader))
+            except (
+                aiohttp.ClientError,
+                asyncio.TimeoutError,
+                ValueError,
+                CircuitOpenError,
+            ):
+                pass
+
+        # A host that has never answered is not waited on again; it is
+        # retried in the background once per TTL instead
+        failure = self.failures.get(hostname)
+        if failure and hostname not in self.cache.entries:
+            if time.monotonic() - failure[0] >= self.cache.ttl:
+                self.failures[hostname] = (time.monotonic(), failure[1])
+                self.cache.refresh(hostname, loader)
+            return self.unreachable(hostname, failure[1])
+
+        try:
+            entry = await self.cache.get(hostname, loader)
+        except (
+            aiohttp.ClientError,
+            asyncio.TimeoutError,
+            ValueError,
+            CircuitOpenError,
+        ) as e:
+            return self.unreachable(hostname, str(e) or e.__class__.__name__)
+
+        return {
+            "hostname": hostname,
+            "status": "stale" if self.cache.is_stale(entry) else "ok",
+            "age": round(entry.age(), 1),
+            "error": entry.error,
+            "data": entry.value,
+        }
+
+    async def get_all(self, hostnames: list[str], refresh=False):
+        return await asyncio.gather(
+            *(self.get_host(hostname, refresh) for hostname in hostnames)
+        )
+
+
+def get_monitored_hostnames():
+    with database() as db:
+        return [host.get("hostname") for host in db.table("monitored_devices").all()]
+
+
+class FleetStatusPlugin:
+    def __init__(self, app: Microdot, local_status):
+        self.app = app
+        self.local_status = local_status
+        self.client = FleetClient("/api/status")
+        app.get("/api/status/all")(self.get_all_status)
+
+    async def get_all_status(self, request: Request):
+        hostnames = await run_blocking(get_monitored_hostnames)
+        local, remote = await asyncio.gather(
+            self.local_status(),
+            self.client.get_all(hostnames),
+        )
+
+        return {
+            "hosts": [
+                {
+                    "hostname": get_hostname(),
+                    "local": True,
+                    "status": "ok",
+                    "age": 0,
+                    "error": None,
+                    "data": local,
+                },
+                *({**host, "local": False} for host in remote),
+            ]
+        }
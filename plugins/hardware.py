@@ -1,35 +1,58 @@
+import asyncio
+import math
 import subprocess
-import time
 import os
+from . import procfs
+from .timings import timed
 
+_cpu_percentages = {}
 
-def get_uptime():
-    result = subprocess.run(
-        ["uptime", "-p"], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
-    )
-    return result.stdout.strip()
 
+@timed
+def get_uptime_seconds():
+    try:
+        return procfs.read_uptime()
+    except (OSError, ValueError, IndexError):
+        return None
 
-def get_temperature():
+
+def get_uptime(seconds):
+    if seconds is None:
+        return "N/A"
+    return procfs.format_uptime(seconds)
+
+
+@timed
+def read_thermal_zone():
+    thermal_root = f"{procfs.SYS_ROOT}/class/thermal"
     try:
-        for dir in os.listdir("/sys/class/thermal/"):
+        for dir in os.listdir(thermal_root):
             if dir.startswith("thermal_zone"):
                 try:
-                    with open(f"/sys/class/thermal/{dir}/type", "r") as f:
+                    with open(f"{thermal_root}/{dir}/type", "r") as f:
                         type_str = f.read().strip().lower()
                         if (
                             "cpu" in type_str
                             or "soc" in type_str
                             or "pkg_temp" in type_str
                         ):
-                            with open(f"/sys/class/thermal/{dir}/temp", "r") as temp_f:
+                            with open(f"{thermal_root}/{dir}/temp", "r") as temp_f:
                                 temp_milli = int(temp_f.read().strip())
-                                return str(temp_milli / 1000.0)
+                                return temp_milli / 1000.0
                 except (OSError, ValueError):
                     continue
     except OSError:
         pass
 
+    return None
+
+
+@timed
+def get_temperature():
+    temperature = read_thermal_zone()
+    if temperature is not None:
+        return str(temperature)
+
     try:
         result = subprocess.run(
             ["vcgencmd", "measure_temp"],
@@ -43,9 +66,10 @@ def get_temperature():
         return "N/A"
 
 
+@timed
 def read_all_cpu_stats():
     cpu_stats = {}
-    with open("/proc/stat", "r") as f:
+    with open(f"{procfs.PROC_ROOT}/stat", "r") as f:
         for line in f:
             if line.startswith("cpu"):
                 parts = line.strip().split()
@@ -78,33 +102,51 @@ def calculate_idle_percent(before, after):
     return percentages
 
 
-def get_cpu_idle_percentages(interval=1.0):
-    try:
-        before = read_all_cpu_stats()
-        time.sleep(interval)
-        after = read_all_cpu_stats()
+async def sample_cpu_usage(interval=1.0):
+    """Keep the latest per-core usage in memory, refreshed every `interval`"""
+    global _cpu_percentages
 
-        return calculate_idle_percent(before, after)
-    except (OSError, ValueError, KeyError):
-        return {}
+    before = None
+    while True:
+        try:
+            after = read_all_cpu_stats()
+            if before is not None:
+                _cpu_percentages = calculate_idle_percent(before, after)
+            before = after
+        except (OSError, ValueError, KeyError):
+            _cpu_percentages = {}
+            before = None
+        await asyncio.sleep(interval)
 
 
-def get_used_and_total_ram():
+def get_cpu_idle_percentages():
+    return _cpu_percentages
+
+
+@timed
+def get_ram_bytes():
     try:
-        result = subprocess.run(
-            ["free", "-h"], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
-        )
-        for line in result.stdout.splitlines():
-            if "Mem:" in line:
-                return line.split()[1:4]
-    except (OSError, IndexError):
+        meminfo = procfs.read_meminfo()
+        total = meminfo["MemTotal"]
+        available = meminfo.get("MemAvailable", meminfo["MemFree"])
+        return {
+            "total": total,
+            "used": total - available,
+            "free": meminfo["MemFree"],
+            "available": available,
+        }
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def get_used_and_total_ram(ram):
+    if ram is None:
         return ["N/A", "N/A", "N/A"]
+    return [procfs.format_size(ram[key]) for key in ("total", "used", "free")]
 
 
+@timed
 def get_used_and_total_disk():
-    result = subprocess.run(
-        ["df", "-h"], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
-    )
     omitted = [
         "tmpfs",
         "udev",
@@ -113,19 +155,35 @@ def get_used_and_total_disk():
         "snap",
         "cgroup",
         "mmcblk0p1",
-        "Filesystem",
     ]
     disks = {}
-    for line in result.stdout.splitlines():
-        if any(x in line for x in omitted):
+    try:
+        mounts = procfs.read_mounts()
+    except OSError:
+        return disks
+
+    for name, mount, fs_type in mounts:
+        if name in disks or fs_type in procfs.PSEUDO_FILESYSTEMS:
+            continue
+        if any(x in name or x in mount for x in omitted):
+            continue
+        try:
+            size, used, available = procfs.disk_usage(mount)
+        except OSError:
             continue
-        name, size, used, available, percent, mount, *_ = line.split()
+        if size == 0:
+            continue
+
+        percent = math.ceil(used * 100 / (used + available)) if used else 0
         disks[name] = {
-            "size": size,
-            "used": used,
-            "available": available,
-            "percent": percent,
+            "size": procfs.format_size(size, binary=False),
+            "used": procfs.format_size(used, binary=False),
+            "available": procfs.format_size(available, binary=False),
+            "percent": f"{percent}%",
             "mount": mount,
+            "size_bytes": size,
+            "used_bytes": used,
+            "available_bytes": available,
         }
 
     return disks
@@ -135,11 +193,16 @@ def reboot():
     subprocess.run(["reboot"])
 
 
+@timed
 def hardware_info():
+    uptime_seconds = get_uptime_seconds()
+    ram_bytes = get_ram_bytes()
     return {
-        "uptime": get_uptime(),
+        "uptime": get_uptime(uptime_seconds),
+        "uptime_seconds": uptime_seconds,
         "temperature": get_temperature(),
         "cpu_idle_percentages": get_cpu_idle_percentages(),
-        "ram": get_used_and_total_ram(),
+        "ram": get_used_and_total_ram(ram_bytes),
+        "ram_bytes": ram_bytes,
         "disk": get_used_and_total_disk(),
     }
@@ -0,0 +1,173 @@
+import asyncio
+import math
+import re
+import time
+from array import array
+from microdot import Microdot, Request
+from . import procfs
+from .hardware import get_cpu_idle_percentages, get_ram_bytes, read_thermal_zone
+
+# (seconds per bucket, number of buckets): 10 minutes, 24 hours and 30 days
+RESOLUTIONS = ((1, 600), (60, 1440), (900, 2880))
+# Single cores are kept for the last 24 hours at minute resolution only, at
+# about 17KB each, so many-core hosts do not pay 58KB per core
+CORE_RESOLUTIONS = ((60, 1440),)
+
+RANGE_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+class Ring:
+    """Fixed-size ring of min/max/avg rollups, one slot per `step` seconds
+
+    Every slot takes 12 bytes (three float32 values), so a series kept at
+    all of RESOLUTIONS costs about 58KB no matter how long the server runs.
+    """
+
+    def __init__(self, step: int, size: int):
+        self.step = step
+        self.size = size
+        self.avg = array("f", [math.nan]) * size
+        self.min = array("f", [math.nan]) * size
+        self.max = array("f", [math.nan]) * size
+        self.head = None
+        self.count = 0
+
+    def _clear(self, bucket: int):
+        index = bucket % self.size
+        self.avg[index] = self.min[index] = self.max[index] = math.nan
+
+    def add(self, timestamp: float, value: float):
+        bucket = int(timestamp // self.step)
+        index = bucket % self.size
+
+        if self.head is None or bucket > self.head:
+            if self.head is not None:
+                for skipped in range(
+                    max(self.head + 1, bucket - self.size + 1), bucket
+                ):
+                    self._clear(skipped)
+            self.head = bucket
+            self.count = 1
+            self.avg[index] = self.min[index] = self.max[index] = value
+            return
+
+        # Samples older than the newest bucket arrive only if the clock
+        # jumped backwards; dropping them keeps the rollups consistent
+        if bucket < self.head:
+            return
+
+        self.count += 1
+        self.avg[index] += (value - self.avg[index]) / self.count
+        self.min[index] = min(self.min[index], value)
+        self.max[index] = max(self.max[index], value)
+
+    def span(self):
+        return self.step * self.size
+
+    def slice(self, buckets: int):
+        """Return the newest `buckets` slots, oldest first"""
+        if self.head is None:
+            return None, [], [], []
+
+        buckets = max(1, min(buckets, self.size))
+        first = self.head - buckets + 1
+        start = first % self.size
+        end = self.head % self.size + 1
+
+        columns = []
+        for values in (self.avg, self.min, self.max):
+            view = memoryview(values)
+            if start < end:
+                column = view[start:end].tolist()
+            else:
+                column = view[start:].tolist() + view[:end].tolist()
+            columns.append([None if v != v else round(v, 2) for v in column])
+
+        return first * self.step, *columns
+
+
+class MetricsHistory:
+    def __init__(self, resolutions=RESOLUTIONS, core_resolutions=CORE_RESOLUTIONS):
+        self.resolutions = resolutions
+        self.core_resolutions = core_resolutions
+        self.series: dict[str, list[Ring]] = {}
+
+    def record(self, name: str, value: float, timestamp: float):
+        rings = self.series.get(name)
+        if rings is None:
+            resolutions = (
+                self.core_resolutions
+                if name.startswith("cpu.core")
+                else self.resolutions
+            )
+            rings = [Ring(step, size) for step, size in resolutions]
+            self.series[name] = rings
+        for ring in rings:
+            ring.add(timestamp, value)
+
+    def query(self, name: str, range_seconds: int):
+        rings = self.series[name]
+        ring = next((r for r in rings if r.span() >= range_seconds), rings[-1])
+        start, avg, min_, max_ = ring.slice(math.ceil(range_seconds / ring.step))
+
+        return {
+            "metric": name,
+            "step": ring.step,
+            "start": start,
+            "avg": avg,
+            "min": min_,
+            "max": max_,
+        }
+
+    def sample(self, timestamp: float):
+        for core, usage in get_cpu_idle_percentages().items():
+            self.record(f"cpu.{core}", usage, timestamp)
+
+        ram = get_ram_bytes()
+        if ram is not None and ram["total"]:
+            self.record("ram", ram["used"] * 100 / ram["total"], timestamp)
+
+        try:
+            _, used, available = procfs.disk_usage("/")
+            if used + available:
+                self.record("disk", used * 100 / (used + available), timestamp)
+        except OSError:
+            pass
+
+        temperature = read_thermal_zone()
+        if temperature is not None:
+            self.record("temperature", temperature, timestamp)
+
+
+def parse_range(value: str):
+    match = re.fullmatch(r"(\d+)([smhd]?)", value.strip())
+    if not match:
+        raise ValueError(f"Invalid range: {value}")
+    return int(match.group(1)) * RANGE_UNITS[match.group(2) or "s"]
+
+
+class MetricsHistoryPlugin:
+    def __init__(self, app: Microdot):
+        self.app = app
+        self.history = MetricsHistory()
+        app.get("/api/status/history")(self.get_history)
+
+    async def run(self, interval=1.0):
+        while True:
+            self.history.sample(time.time())
+            await asyncio.sleep(interval)
+
+    async def get_history(self, request: Request):
+        metric = request.args.get("metric")
+        if metric not in self.history.series:
+            return {
+                "error": "Unknown metric",
+                "metrics": sorted(self.history.series),
+            }, 404
+
+        try:
+            range_seconds = parse_range(request.args.get("range", "10m"))
+        except ValueError as e:
+            return {"error": str(e)}, 400
+
+        return self.history.query(metric, range_seconds)
@@ -0,0 +1,198 @@
+import gzip
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from microdot import Microdot, Request, Response
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MIN_COMPRESS_SIZE = 1024
+MAX_CACHED_FILE_SIZE = 5 * 1024 * 1024
+# Body plus compressed variants of every cached file together
+MAX_CACHE_SIZE = 32 * 1024 * 1024
+COMPRESSIBLE_TYPES = (
+    "application/json",
+    "application/javascript",
+    "application/openmetrics-text",
+    "image/svg+xml",
+    "text/",
+)
+# Bundles emitted by webpack carry a content hash and never change
+HASHED_FILENAME = re.compile(r"\.[0-9a-f]{16,}\.")
+
+
+def make_etag(body: bytes):
+    return 'W/"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+
+
+def etag_matches(request: Request, etag: str):
+    if_none_match = request.headers.get("If-None-Match")
+    if not if_none_match:
+        return False
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return "*" in tags or etag.removeprefix("W/") in tags
+
+
+def preferred_encoding(request: Request):
+    accepted = set()
+    for part in request.headers.get("Accept-Encoding", "").split(","):
+        encoding, _, params = part.partition(";")
+        params = params.replace(" ", "")
+        try:
+            quality = float(params[2:]) if params.startswith("q=") else 1.0
+        except ValueError:
+            quality = 1.0
+        if quality > 0:
+            accepted.add(encoding.strip().lower())
+
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+def compress(body: bytes, encoding: str):
+    if encoding == "br":
+        return brotli.compress(body, quality=5)
+    return gzip.compress(body, compresslevel=6)
+
+
+def content_type_for(path: str):
+    return Response.types_map.get(path.split(".")[-1], "application/octet-stream")
+
+
+def is_compressible(content_type: str):
+    return content_type.startswith(COMPRESSIBLE_TYPES)
+
+
+class StaticFiles:
+    """Serve files from memory with ETags and cached compressed variants
+
+    Only files under `root` are cached, least recently used first out once
+    the cache holds more than `max_size` bytes. A file is read again only
+    when its size or modification time changes. Handlers run on worker
+    threads, so the cache is only touched with `lock` held; reading and
+    compressing happen outside of it.
+    """
+
+    def __init__(self, root="public", max_size=MAX_CACHE_SIZE):
+        self.root = os.path.abspath(root)
+        self.max_size = max_size
+        self.size = 0
+        self.files: OrderedDict[str, dict] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def is_cacheable(self, path: str):
+        return os.path.commonpath([self.root, os.path.abspath(path)]) == self.root
+
+    def store(self, entry: dict, size: int):
+        """Account `size` more bytes to a cached entry, called with `lock` held"""
+        entry["size"] += size
+        self.size += size
+        while self.size > self.max_size and len(self.files) > 1:
+            _, evicted = self.files.popitem(last=False)
+            self.size -= evicted["size"]
+
+    def load(self, path: str):
+        stat = os.stat(path)
+        version = (stat.st_mtime_ns, stat.st_size)
+        with self.lock:
+            cached = self.files.get(path)
+            if cached and cached["version"] == version:
+                self.files.move_to_end(path)
+                return cached
+
+        with open(path, "rb") as f:
+            body = f.read()
+        entry = {
+            "version": version,
+            "body": body,
+            "etag": make_etag(body),
+            "content_type": content_type_for(path),
+            "size": 0,
+        }
+        with self.lock:
+            previous = self.files.pop(path, None)
+            if previous is not None:
+                self.size -= previous["size"]
+            self.files[path] = entry
+            self.store(entry, len(body))
+        return entry
+
+    def response(self, request: Request, path: str):
+        if not self.is_cacheable(path) or os.path.getsize(path) > MAX_CACHED_FILE_SIZE:
+            return Response.send_file(path)
+
+        entry = self.load(path)
+        headers = {
+            "Content-Type": entry["content_type"],
+            "ETag": entry["etag"],
+            "Vary": "Accept-Encoding",
+            "Cache-Control": (
+                "max-age=31536000, immutable"
+                if HASHED_FILENAME.search(os.path.basename(path))
+                else "no-cache"
+            ),
+        }
+        if etag_matches(request, entry["etag"]):
+            return Response(status_code=304, headers=headers, reason="Not Modified")
+
+        encoding = preferred_encoding(request)
+        body = entry["body"]
+        if (
+            encoding
+            and len(body) >= MIN_COMPRESS_SIZE
+            and is_compressible(entry["content_type"])
+        ):
+            compressed = entry.get(encoding)
+            if compressed is None:
+                compressed = compress(body, encoding)
+                with self.lock:
+                    if encoding not in entry:
+                        entry[encoding] = compressed
+                        if self.files.get(path) is entry:
+                            self.store(entry, len(compressed))
+            body = compressed
+            headers["Content-Encoding"] = encoding
+
+        return Response(body, headers=headers)
+
+
+def conditional_response(request: Request, response: Response):
+    """Add an ETag to GET responses, answer If-None-Match with 304 and
+    compress bodies above MIN_COMPRESS_SIZE"""
+    if request.method not in ("GET", "HEAD") or response.status_code != 200:
+        return response
+    if not isinstance(response.body, bytes):
+        return response
+
+    content_type = response.headers.get("Content-Type", Response.default_content_type)
+    compressible = "Content-Encoding" not in response.headers and is_compressible(
+        content_type
+    )
+    if compressible:
+        response.headers["Vary"] = "Accept-Encoding"
+
+    if "ETag" not in response.headers:
+        response.headers["ETag"] = make_etag(response.body)
+    if etag_matches(request, response.headers["ETag"]):
+        response.status_code = 304
+        response.reason = "Not Modified"
+        response.body = b""
+        return response
+
+    encoding = preferred_encoding(request)
+    if compressible and encoding and len(response.body) >= MIN_COMPRESS_SIZE:
+        response.body = compress(response.body, encoding)
+        response.headers["Content-Encoding"] = encoding
+    return response
+
+
+def install(app: Microdot):
+    app.after_request(conditional_response)
@@ -0,0 +1,25 @@
+import aiohttp
+
+_session = None
+
+
+def get_session():
+    """Return the process-wide pooled HTTP session, creating it on first use"""
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=64,
+                limit_per_host=4,
+                ttl_dns_cache=300,
+            ),
+            timeout=aiohttp.ClientTimeout(total=10, sock_connect=3),
+        )
+    return _session
+
+
+async def close_session():
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
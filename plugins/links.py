@@ -1,8 +1,24 @@
-from microdot import Microdot, Request
+from microdot import Microdot, Request, Response
 from pydantic import BaseModel, HttpUrl, Field
-from tinydb import TinyDB, where
-import requests
+from .storage import database, DATA_DIR
+from .http_client import get_session
+from .concurrency import run_blocking
 from html.parser import HTMLParser
+from urllib.parse import urljoin
+import aiohttp
+import asyncio
+import codecs
+import hashlib
+import os
+import tempfile
+
+ICONS_DIR = os.path.join(DATA_DIR, "icons")
+MAX_PAGE_SIZE = 512 * 1024
+MAX_ICON_SIZE = 256 * 1024
+# Links are ordered by sparse integer ranks, so a move only rewrites the
+# moved link; ranks are respaced once two neighbours leave no room between
+RANK_GAP = 1024
+ICON_TIMEOUT = aiohttp.ClientTimeout(total=10, sock_connect=3)
 
 
 # Parse HTML to find an icon
@@ -10,17 +26,89 @@ class DocumentParser(HTMLParser):
     def __init__(self):
         super().__init__()
         self.icon = None
+        self.done = False
 
     def handle_starttag(self, tag, attrs):
         if self.icon:
             return
 
-        if tag == "link":
+        if tag == "body":
+            self.done = True
+        elif tag == "link":
             for attr in attrs:
-                if attr[0] == "rel" and "icon" in attr[1]:
+                if attr[0] == "rel" and "icon" in (attr[1] or ""):
                     self.icon = dict(attrs).get("href")
+                    self.done = True
                     break
 
+    def handle_endtag(self, tag):
+        if tag == "head":
+            self.done = True
+
+
+async def read_limited(response: aiohttp.ClientResponse, limit: int):
+    body = bytearray()
+    async for chunk in response.content.iter_chunked(16384):
+        body += chunk
+        if len(body) > limit:
+            raise ValueError("Response too large")
+    return bytes(body)
+
+
+async def find_icon_url(url: str):
+    """Stream the page head and return the icon it links to, if any"""
+    async with get_session().get(url, timeout=ICON_TIMEOUT) as response:
+        response.raise_for_status()
+        try:
+            decoder_class = codecs.getincrementaldecoder(response.charset or "utf-8")
+        except LookupError:
+            # Pages declaring a charset Python does not know
+            decoder_class = codecs.getincrementaldecoder("utf-8")
+        decoder = decoder_class(errors="replace")
+        parser = DocumentParser()
+        size = 0
+        async for chunk in response.content.iter_chunked(16384):
+            size += len(chunk)
+            parser.feed(decoder.decode(chunk))
+            if parser.done or size >= MAX_PAGE_SIZE:
+                break
+
+    if parser.icon:
+        return urljoin(url, parser.icon)
+    return None
+
+
+async def download_icon(url: str):
+    """Download an icon into ICONS_DIR, returning its hash and content type"""
+    async with get_session().get(url, timeout=ICON_TIMEOUT) as response:
+        response.raise_for_status()
+        content_type = response.content_type
+        if not content_type.startswith("image/"):
+            raise ValueError(f"Not an image: {content_type}")
+        # SVG can carry scripts, and icons are served from our own origin
+        if content_type == "image/svg+xml":
+            raise ValueError("SVG icons are not stored")
+        body = await read_limited(response, MAX_ICON_SIZE)
+
+    digest = hashlib.sha256(body).hexdigest()
+    await asyncio.to_thread(save_icon, digest, body)
+    return digest, content_type
+
+
+def save_icon(digest: str, body: bytes):
+    path = os.path.join(ICONS_DIR, digest)
+    if os.path.exists(path):
+        return
+    os.makedirs(ICONS_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=ICONS_DIR, prefix=".icon-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(body)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
 
 class Link(BaseModel):
     url: HttpUrl
@@ -33,6 +121,10 @@ class LinkOrderInput(BaseModel):
     index: int = Field(..., description="The new index of the link", ge=0)
 
 
+class LinksOrderInput(BaseModel):
+    ids: list[int] = Field(..., description="IDs of all links in the new order")
+
+
 class LinkPlugin:
     def __init__(self, app: Microdot):
         self.app = app
@@ -40,80 +132,182 @@ class LinkPlugin:
         app.put("/api/link")(self.put_link)
         app.delete("/api/link/<id>")(self.delete_link)
         app.post("/api/link/order")(self.reorder_links)
+        app.put("/api/link/order")(self.set_links_order)
+        app.get("/api/link/<id>/icon")(self.get_icon)
+        self.tasks: set[asyncio.Task] = set()
 
-    def reindex_links(self, db: TinyDB):
-        links_table = db.table("links")
-        all_links = sorted(links_table.all(), key=lambda x: x["order"])
+    def icon_url(self, link):
+        if link.get("icon_file"):
+            return f"/api/link/{link.doc_id}/icon?v={link['icon_file'][:12]}"
+        return link.get("icon")
 
-        for index, link in enumerate(all_links):
-            links_table.update({"order": index}, doc_ids=[link.doc_id])
+    async def resolve_icon(self, id: int, url: str, icon: str | None):
+        """Find and download the icon of a link, storing it on the link"""
+        try:
+            if icon is None:
+                icon = await find_icon_url(url) or urljoin(url, "/favicon.ico")
+            digest, content_type = await download_icon(icon)
+            fields = {"icon": icon, "icon_file": digest, "icon_type": content_type}
+        except (
+            aiohttp.ClientError,
+            asyncio.TimeoutError,
+            LookupError,
+            OSError,
+            ValueError,
+        ) as e:
+            print(f"Could not fetch icon for {url}: {e or e.__class__.__name__}")
+            fields = {"icon_checked": True}
+
+        with database() as db:
+            links_table = db.table("links")
+            if links_table.get(doc_id=id) is not None:
+                links_table.update(fields, doc_ids=[id])
+
+    def schedule_icon(self, id: int, url: str, icon: str | None):
+        if icon is not None and icon.startswith("data:"):
+            return
+        task = asyncio.create_task(self.resolve_icon(id, url, icon))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def get_links_without_icon(self):
+        with database() as db:
+            return [
+                link
+                for link in db.table("links").all()
+                if not link.get("icon_file") and not link.get("icon_checked")
+            ]
+
+    async def run(self):
+        """Fetch icons of links stored before icons were cached locally"""
+        # Loading the database must not hold up the first requests
+        links = await run_blocking(self.get_links_without_icon)
+        for link in links:
+            self.schedule_icon(link.doc_id, link["url"], link.get("icon"))
+
+    def rebalance_links(self, links_table, links):
+        for index, link in enumerate(links):
+            rank = (index + 1) * RANK_GAP
+            if link["order"] != rank:
+                links_table.update({"order": rank}, doc_ids=[link.doc_id])
+                link["order"] = rank
 
     def get_links(self, request: Request):
-        with TinyDB("data/db.json") as db:
-            links = sorted(db.table("links").all(), key=lambda x: x["order"])
+        with database() as db:
+            links = db.table("links").all(order_by="order")
 
             return [
                 {
                     "id": link.doc_id,
                     "name": link["name"],
                     "url": link["url"],
-                    "icon": link.get("icon"),
+                    "icon": self.icon_url(link),
                 }
                 for link in links
             ]
 
-    def put_link(self, request: Request):
-        with TinyDB("data/db.json") as db:
+    async def put_link(self, request: Request):
+        data = request.json
+        link = Link(**data)
+
+        with database() as db:
             links_table = db.table("links")
-            data = request.json
-            link = Link(**data)
-
-            if not link.icon:
-                response = requests.get(link.url)
-                if response.status_code == 200:
-                    parser = DocumentParser()
-                    parser.feed(response.text)
-                    if parser.icon:
-                        if parser.icon.startswith("http") or parser.icon.startswith(
-                            "data:"
-                        ):
-                            link.icon = parser.icon
-                        else:
-                            link.icon = requests.compat.urljoin(
-                                link.url.__str__(), parser.icon
-                            )
-
-            links_table.insert(
+            last = links_table.all(order_by="order", descending=True, limit=1)
+            id = links_table.insert(
                 {
                     **link.model_dump(mode="json"),
-                    "order": len(links_table.all()),
+                    "order": (last[0]["order"] if last else 0) + RANK_GAP,
                 }
             )
-            self.reindex_links(db)
 
-            return "", 204
+        # The icon is looked up in the background so adding a link is instant
+        self.schedule_icon(id, str(link.url), link.icon)
+        return "", 204
+
+    def get_icon(self, request: Request, id: str):
+        with database() as db:
+            link = db.table("links").get(doc_id=int(id))
+        if link is None or not link.get("icon_file"):
+            return {"error": "Icon not found"}, 404
+
+        try:
+            with open(os.path.join(ICONS_DIR, link["icon_file"]), "rb") as f:
+                body = f.read()
+        except FileNotFoundError:
+            return {"error": "Icon not found"}, 404
+
+        return Response(
+            body,
+            headers={
+                "Content-Type": link["icon_type"],
+                "Cache-Control": "max-age=31536000, immutable",
+                "ETag": f'"{link["icon_file"]}"',
+                # Icons stored before SVG was refused must not run either
+                "Content-Security-Policy": "sandbox",
+                "X-Content-Type-Options": "nosniff",
+            },
+        )
 
     def delete_link(self, request: Request, id: str):
-        with TinyDB("data/db.json") as db:
+        with database() as db:
             links_table = db.table("links")
+            link = links_table.get(doc_id=int(id))
             links_table.remove(doc_ids=[int(id)])
-            self.reindex_links(db)
+
+            # Icons are shared by every link with the same content
+            icon_file = link.get("icon_file") if link else None
+            if icon_file and not links_table.find(icon_file=icon_file):
+                try:
+                    os.remove(os.path.join(ICONS_DIR, icon_file))
+                except FileNotFoundError:
+                    pass
             return "", 204
 
     def reorder_links(self, request: Request):
+        """Move a link in front of the link currently at `index`"""
         input_data = LinkOrderInput(**request.json)
 
-        with TinyDB("data/db.json") as db:
+        with database() as db:
             links_table = db.table("links")
-            all_links = links_table.all()
+            links = links_table.all(order_by="order")
+            ids = [link.doc_id for link in links]
+            if input_data.id not in ids:
+                return {"error": "Link not found"}, 404
+
+            current = ids.index(input_data.id)
+            position = min(input_data.index, len(links))
+            if position == current:
+                return "", 204
+            moved = links.pop(current)
+            if current < position:
+                position -= 1
+
+            for _ in range(2):
+                lower = links[position - 1]["order"] if position > 0 else 0
+                upper = (
+                    links[position]["order"]
+                    if position < len(links)
+                    else lower + 2 * RANK_GAP
+                )
+                if upper - lower > 1:
+                    break
+                self.rebalance_links(links_table, links)
+
+            links_table.update({"order": (lower + upper) // 2}, doc_ids=[moved.doc_id])
+            return "", 204
 
-            for link in all_links:
-                if link["order"] >= input_data.index:
-                    links_table.update(
-                        {"order": link["order"] + 1}, doc_ids=[link.doc_id]
-                    )
+    def set_links_order(self, request: Request):
+        """Replace the whole order at once; links not listed keep their place
+        after the listed ones"""
+        input_data = LinksOrderInput(**request.json)
 
-            links_table.update({"order": input_data.index}, doc_ids=[input_data.id])
-            self.reindex_links(db)
+        with database() as db:
+            links_table = db.table("links")
+            links = {link.doc_id: link for link in links_table.all(order_by="order")}
+            unknown = [id for id in input_data.ids if id not in links]
+            if unknown:
+                return {"error": "Link not found", "ids": unknown}, 404
 
+            ordered = [links.pop(id) for id in dict.fromkeys(input_data.ids)]
+            self.rebalance_links(links_table, ordered + list(links.values()))
             return "", 204
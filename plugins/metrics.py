@@ -0,0 +1,228 @@
+import asyncio
+import io
+import time
+from microdot import Microdot, Request, Response
+from .concurrency import run_blocking
+from .docker import DockerPlugin
+from .hardware import (
+    get_cpu_idle_percentages,
+    get_ram_bytes,
+    get_uptime_seconds,
+    get_used_and_total_disk,
+    read_thermal_zone,
+)
+from .service import ServicePlugin
+
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+PREFIX = "home_dashboard_"
+UNIT_STATES = ("active", "inactive", "failed", "activating", "deactivating")
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class MetricsWriter:
+    """Render metric families into a reused text buffer"""
+
+    def __init__(self):
+        self.buffer = io.StringIO()
+
+    def reset(self):
+        self.buffer.seek(0)
+        self.buffer.truncate()
+
+    def family(self, name: str, type: str, help: str, unit: str | None = None):
+        write = self.buffer.write
+        write(f"# TYPE {PREFIX}{name} {type}\n")
+        if unit:
+            write(f"# UNIT {PREFIX}{name} {unit}\n")
+        write(f"# HELP {PREFIX}{name} {help}\n")
+
+    def sample(self, metric: str, value, /, **labels):
+        write = self.buffer.write
+        write(PREFIX)
+        write(metric)
+        if labels:
+            write("{")
+            write(
+                ",".join(
+                    f'{key}="{escape_label(label)}"' for key, label in labels.items()
+                )
+            )
+            write("}")
+        write(" ")
+        write(str(int(value)) if isinstance(value, bool) else repr(float(value)))
+        write("\n")
+
+    def getvalue(self, eof=True):
+        if eof:
+            self.buffer.write("# EOF\n")
+        return self.buffer.getvalue().encode()
+
+
+class MetricsPlugin:
+    """Prometheus/OpenMetrics endpoint
+
+    The text is rendered every `interval` seconds from the samples the
+    other plugins already keep in memory, so a scrape only returns bytes.
+    Failed renders keep the previous text and are counted, and the time of
+    the last good render is exported so stale values can be alerted on.
+    """
+
+    def __init__(self, app: Microdot, docker: DockerPlugin, services: ServicePlugin):
+        self.app = app
+        self.docker = docker
+        self.services = services
+        self.writer = MetricsWriter()
+        self.body = b""
+        self.errors = 0
+        self.rendered_at = None
+        app.get("/metrics")(self.get_metrics)
+
+    async def run(self, interval=15.0, first_delay=2.0):
+        # Give the CPU sampler time for its first reading
+        await asyncio.sleep(first_delay)
+        while True:
+            try:
+                host = await run_blocking(self.sample_host)
+                units = await self.services.units.get_units()
+                self.body = self.render(host, units)
+                self.rendered_at = time.time()
+            except Exception as e:
+                self.errors += 1
+                print(f"Could not render metrics: {e!r}")
+            await asyncio.sleep(interval)
+
+    def sample_host(self):
+        return {
+            "ram": get_ram_bytes(),
+            "disks": get_used_and_total_disk(),
+            "temperature": read_thermal_zone(),
+            "uptime": get_uptime_seconds(),
+        }
+
+    def render(self, host: dict, units: list | None):
+        writer = self.writer
+        writer.reset()
+
+        writer.family("cpu_usage_ratio", "gauge", "CPU usage per core", "ratio")
+        for core, usage in get_cpu_idle_percentages().items():
+            writer.sample("cpu_usage_ratio", usage / 100, cpu=core)
+
+        if host["ram"] is not None:
+            writer.family("memory_bytes", "gauge", "Memory by kind", "bytes")
+            for kind, value in host["ram"].items():
+                writer.sample("memory_bytes", value, kind=kind)
+
+        writer.family("disk_size_bytes", "gauge", "Filesystem size", "bytes")
+        for device, disk in host["disks"].items():
+            writer.sample(
+                "disk_size_bytes",
+                disk["size_bytes"],
+                device=device,
+                mount=disk["mount"],
+            )
+        writer.family("disk_used_bytes", "gauge", "Filesystem space used", "bytes")
+        for device, disk in host["disks"].items():
+            writer.sample(
+                "disk_used_bytes",
+                disk["used_bytes"],
+                device=device,
+                mount=disk["mount"],
+            )
+        writer.family("disk_available_bytes", "gauge", "Filesystem space free", "bytes")
+        for device, disk in host["disks"].items():
+            writer.sample(
+                "disk_available_bytes",
+                disk["available_bytes"],
+                device=device,
+                mount=disk["mount"],
+            )
+
+        if host["temperature"] is not None:
+            writer.family("temperature_celsius", "gauge", "SoC temperature", "celsius")
+            writer.sample("temperature_celsius", host["temperature"])
+
+        if host["uptime"] is not None:
+            writer.family("uptime_seconds", "gauge", "Time since boot", "seconds")
+            writer.sample("uptime_seconds", host["uptime"])
+
+        self.render_containers(writer)
+        if units is not None:
+            self.render_units(writer, units)
+
+        return writer.getvalue(eof=False)
+
+    def render_status(self):
+        writer = MetricsWriter()
+        writer.family("metrics_render_errors", "counter", "Failed metric renders")
+        writer.sample("metrics_render_errors_total", self.errors)
+        if self.rendered_at is not None:
+            writer.family(
+                "metrics_rendered_timestamp_seconds",
+                "gauge",
+                "Time of the last metric render",
+                "seconds",
+            )
+            writer.sample("metrics_rendered_timestamp_seconds", self.rendered_at)
+        return writer.getvalue()
+
+    def render_containers(self, writer: MetricsWriter):
+        containers = self.docker.containers
+        counters = self.docker.counters
+
+        writer.family("container_running", "gauge", "Whether a container runs")
+        for container in containers.values():
+            writer.sample(
+                "container_running",
+                container["running"],
+                name=container["name"],
+                image=container["image"],
+            )
+
+        writer.family(
+            "container_memory_bytes", "gauge", "Container memory usage", "bytes"
+        )
+        for container_id, (_, counter) in counters.items():
+            if container_id in containers:
+                writer.sample(
+                    "container_memory_bytes",
+                    counter["memory_usage"],
+                    name=containers[container_id]["name"],
+                )
+
+        for key, help in (
+            ("cpu", "Container CPU time"),
+            ("network_rx", "Bytes received by a container"),
+            ("network_tx", "Bytes sent by a container"),
+            ("block_read", "Bytes read from block devices by a container"),
+            ("block_write", "Bytes written to block devices by a container"),
+        ):
+            unit = "seconds" if key == "cpu" else "bytes"
+            writer.family(f"container_{key}_{unit}", "counter", help, unit)
+            for container_id, (_, counter) in counters.items():
+                if container_id not in containers:
+                    continue
+                value = counter["cpu_usec"] / 1e6 if key == "cpu" else counter[key]
+                writer.sample(
+                    f"container_{key}_{unit}_total",
+                    value,
+                    name=containers[container_id]["name"],
+                )
+
+    def render_units(self, writer: MetricsWriter, units: list):
+        writer.family("systemd_unit_state", "stateset", "systemd service state")
+        for unit in units:
+            for state in UNIT_STATES:
+                writer.sample(
+                    "systemd_unit_state",
+                    unit["state"] == state,
+                    name=unit["name"],
+                    **{f"{PREFIX}systemd_unit_state": state},
+                )
+
+    async def get_metrics(self, request: Request):
+        return Response(
+            self.body + self.render_status(), headers={"Content-Type": CONTENT_TYPE}
+        )
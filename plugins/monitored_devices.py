@@ -1,6 +1,6 @@
 from microdot import Microdot, Request
 from pydantic import Field, BaseModel
-from tinydb import TinyDB
+from .storage import database
 
 
 class DeviceInput(BaseModel):
@@ -14,7 +14,7 @@ class MonitoredDevicesPlugin:
         app.delete("/api/monitored_devices/<device_id>")(self.remove_device)
 
     def add_device(self, request: Request):
-        with TinyDB("data/db.json") as db:
+        with database() as db:
             table = db.table("monitored_devices")
             data = request.json
             device_input = DeviceInput(**data)
@@ -22,7 +22,7 @@ class MonitoredDevicesPlugin:
             return "", 204
 
     def get_devices(self, request: Request):
-        with TinyDB("data/db.json") as db:
+        with database() as db:
             table = db.table("monitored_devices")
             devices = table.all()
             for device in devices:
@@ -30,7 +30,7 @@ class MonitoredDevicesPlugin:
             return devices
 
     def remove_device(self, request: Request, device_id: str):
-        with TinyDB("data/db.json") as db:
+        with database() as db:
             table = db.table("monitored_devices")
             table.remove(doc_ids=[int(device_id)])
             return "", 204
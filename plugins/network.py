@@ -1,13 +1,37 @@
-import urllib.request
+import aiohttp
+import asyncio
+import ipaddress
+import os
+import socket
 import subprocess
-from functools import lru_cache
+import time
 from enum import Enum
-from .utils import get_ttl_hash
-from dbus_fast import BusType
-from dbus_fast.aio import MessageBus
+from .cache import AsyncTTLCache
+from .http_client import get_session
+from .timings import timed
+from .utils import system_bus_available
 
 _bus = None
 
+# Seconds between attempts to reach NetworkManager or the external IP
+# providers after a failure
+RETRY_INTERVAL = 30
+EXTERNAL_IP_PROVIDERS = [
+    url.strip()
+    for url in os.getenv(
+        "EXTERNAL_IP_PROVIDERS",
+        "http://icanhazip.com,https://api.ipify.org,https://ifconfig.me/ip",
+    ).split(",")
+    if url.strip()
+]
+EXTERNAL_IP_TIMEOUT = 3
+# The address is refreshed in the background a minute before it expires and
+# the last known one is served for up to an hour if every provider fails
+_external_ip = AsyncTTLCache(
+    ttl=300, stale_ttl=3600, maxsize=1, refresh_ahead=60, name="external_ip"
+)
+_external_ip_failed_at = None
+
 
 class DeviceType(Enum):
     UNKNOWN = 0
@@ -52,24 +76,64 @@ def is_physical_device(device_type):
 
 
 def get_hostname():
-    result = subprocess.run(
-        ["hostname"], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
-    )
-    return result.stdout.strip()
+    return socket.gethostname()
+
+
+async def fetch_external_ip(url: str):
+    async with get_session().get(
+        url, timeout=aiohttp.ClientTimeout(total=EXTERNAL_IP_TIMEOUT)
+    ) as response:
+        response.raise_for_status()
+        return str(ipaddress.ip_address((await response.text()).strip()))
 
 
-@lru_cache()
-def check_external_ip(cache_key=None):
+@timed
+async def resolve_external_ip():
+    """Ask every provider at once and return the first valid answer"""
+    tasks = [
+        asyncio.create_task(fetch_external_ip(url)) for url in EXTERNAL_IP_PROVIDERS
+    ]
     try:
-        with urllib.request.urlopen("http://icanhazip.com", timeout=3) as response:
-            return response.read().decode().strip()
-    except Exception:
+        for next_result in asyncio.as_completed(tasks):
+            try:
+                return await next_result
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+                continue
+    finally:
+        for task in tasks:
+            task.cancel()
+    raise LookupError("No external IP provider answered")
+
+
+@timed
+async def check_external_ip():
+    global _external_ip_failed_at
+
+    # Until a provider has answered once, they are not waited on again but
+    # retried in the background
+    if "external_ip" not in _external_ip.entries and _external_ip_failed_at:
+        if time.monotonic() - _external_ip_failed_at >= RETRY_INTERVAL:
+            _external_ip_failed_at = time.monotonic()
+            _external_ip.refresh("external_ip", resolve_external_ip)
+        return "?"
+
+    try:
+        entry = await _external_ip.get("external_ip", resolve_external_ip)
+    except LookupError:
+        _external_ip_failed_at = time.monotonic()
         return "?"
+    return entry.value
 
 
 async def get_bus():
     global _bus
     if _bus is None or not _bus.connected:
+        if not system_bus_available():
+            return None
+
+        from dbus_fast.aio import MessageBus
+        from dbus_fast import BusType
+
         try:
             _bus = await MessageBus(bus_type=BusType.SYSTEM).connect()
         except Exception:
@@ -77,6 +141,7 @@ async def get_bus():
     return _bus
 
 
+@timed
 def check_local_ip_fallback():
     try:
         result = subprocess.run(
@@ -108,70 +173,190 @@ def check_local_ip_fallback():
         return []
 
 
-async def check_local_ip():
-    bus = await get_bus()
-    if not bus:
-        return check_local_ip_fallback()
+class NetworkManagerMonitor:
+    """Local addresses of NetworkManager devices, kept in memory
+
+    Devices are loaded once, with introspection data and proxies cached per
+    object path, and then updated from NetworkManager signals instead of
+    being queried again on every status request.
+    """
 
-    ips = []
     bus_name = "org.freedesktop.NetworkManager"
+    path = "/org/freedesktop/NetworkManager"
 
-    try:
-        nm_intro = await bus.introspect(bus_name, "/org/freedesktop/NetworkManager")
-        nm = bus.get_proxy_object(
-            bus_name,
-            "/org/freedesktop/NetworkManager",
-            nm_intro,
-        )
-        nm_interface = nm.get_interface(bus_name)
-        devices = await nm_interface.get_all_devices()
-
-        for device in devices:
-            device_intro = await bus.introspect(bus_name, device)
-            device_obj = bus.get_proxy_object(
-                bus_name,
-                device,
-                device_intro,
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.tasks = set()
+        self.failed_at = None
+        self.reset()
+
+    def reset(self):
+        self.bus = None
+        self.proxies = {}
+        self.devices = {}
+        self.subscribed = set()
+        # IP4Config path -> its Properties interface and signal handler
+        self.ip4_watches = {}
+        self.ready = False
+
+    async def get_interface(self, path: str, interface: str):
+        proxy = self.proxies.get(path)
+        if proxy is None:
+            introspection = await self.bus.introspect(self.bus_name, path)
+            proxy = self.bus.get_proxy_object(self.bus_name, path, introspection)
+            self.proxies[path] = proxy
+        return proxy.get_interface(interface)
+
+    def schedule(self, coroutine):
+        task = asyncio.create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def connect(self):
+        bus = await get_bus()
+        if bus is None:
+            self.reset()
+            return False
+        if bus is not self.bus:
+            self.reset()
+            self.bus = bus
+        if self.ready:
+            return True
+        # Without NetworkManager on the bus, retry only now and then
+        if self.failed_at and time.monotonic() - self.failed_at < RETRY_INTERVAL:
+            return False
+
+        async with self.lock:
+            if self.ready:
+                return True
+            try:
+                nm = await self.get_interface(self.path, self.bus_name)
+                if self.path not in self.subscribed:
+                    nm.on_device_added(
+                        lambda path: self.schedule(self.load_device(path))
+                    )
+                    nm.on_device_removed(self.remove_device)
+                    self.subscribed.add(self.path)
+                devices = await nm.get_all_devices()
+                await asyncio.gather(*(self.load_device(path) for path in devices))
+            except Exception:
+                self.failed_at = time.monotonic()
+                return False
+            self.ready = True
+            self.failed_at = None
+        return True
+
+    async def load_device(self, path: str):
+        try:
+            device = await self.get_interface(
+                path, "org.freedesktop.NetworkManager.Device"
             )
-            device_interface = device_obj.get_interface(
-                "org.freedesktop.NetworkManager.Device"
+            ip4_config, device_type, udi = await asyncio.gather(
+                device.get_ip4_config(),
+                device.get_device_type(),
+                device.get_udi(),
             )
+            device_type = DeviceType(device_type)
 
-            ipv4_config = await device_interface.get_ip4_config()
+            addresses = []
+            if ip4_config != "/":
+                ip4 = await self.get_interface(
+                    ip4_config, "org.freedesktop.NetworkManager.IP4Config"
+                )
+                address_data = await ip4.get_address_data()
+                addresses = [
+                    item["address"].value
+                    for item in address_data
+                    if item.get("address") and item["address"].value
+                ]
+                await self.watch_ip4_config(path, ip4_config)
 
-            if ipv4_config != "/":
-                ip4_intro = await bus.introspect(bus_name, ipv4_config)
-                ip4_obj = bus.get_proxy_object(
-                    bus_name,
-                    ipv4_config,
-                    ip4_intro,
+            if path not in self.subscribed:
+                properties = await self.get_interface(
+                    path, "org.freedesktop.DBus.Properties"
                 )
-                ip4_interface = ip4_obj.get_interface(
-                    "org.freedesktop.NetworkManager.IP4Config"
+                properties.on_properties_changed(
+                    lambda interface, changed, invalidated: self.device_changed(
+                        path, changed
+                    )
                 )
-                address_data = await ip4_interface.get_address_data()
-                device_type = DeviceType(await device_interface.get_device_type())
-                udi = await device_interface.get_udi()
-
-                for item in address_data:
-                    addr = item.get("address").value
-                    if addr and is_physical_device(device_type):
-                        ips.append(
-                            {
-                                "address": addr,
-                                "device": udi.split("/")[-1],
-                                "type": DeviceType(device_type).name.lower(),
-                            }
-                        )
-    except Exception:
-        return check_local_ip_fallback()
+                self.subscribed.add(path)
+        except Exception as e:
+            print(f"Could not load NetworkManager device {path}: {e}")
+            self.devices.pop(path, None)
+            return
+
+        previous = self.devices.get(path)
+        if previous and previous["ip4_config"] != ip4_config:
+            self.unwatch_ip4_config(previous["ip4_config"])
+        self.devices[path] = {
+            "device": udi.split("/")[-1],
+            "type": device_type,
+            "ip4_config": ip4_config,
+            "addresses": addresses,
+        }
+
+    async def watch_ip4_config(self, device_path: str, ip4_config: str):
+        """Reload the device when NetworkManager changes the addresses of its
+        IP4Config in place, as it does on DHCP renewals"""
+        if ip4_config in self.ip4_watches:
+            return
+        properties = await self.get_interface(
+            ip4_config, "org.freedesktop.DBus.Properties"
+        )
+
+        def changed(interface, changed, invalidated):
+            if "AddressData" in changed and device_path in self.devices:
+                self.schedule(self.load_device(device_path))
+
+        properties.on_properties_changed(changed)
+        self.ip4_watches[ip4_config] = (properties, changed)
 
-    return ips if ips else check_local_ip_fallback()
+    def unwatch_ip4_config(self, ip4_config: str):
+        watch = self.ip4_watches.pop(ip4_config, None)
+        if watch:
+            properties, changed = watch
+            properties.off_properties_changed(changed)
+        self.proxies.pop(ip4_config, None)
+
+    def device_changed(self, path: str, changed: dict):
+        if path in self.devices and ("Ip4Config" in changed or "State" in changed):
+            self.schedule(self.load_device(path))
+
+    def remove_device(self, path: str):
+        device = self.devices.pop(path, None)
+        if device:
+            self.unwatch_ip4_config(device["ip4_config"])
+
+    async def local_ips(self):
+        if not await self.connect():
+            return None
+
+        return [
+            {
+                "address": address,
+                "device": device["device"],
+                "type": device["type"].name.lower(),
+            }
+            for device in self.devices.values()
+            if is_physical_device(device["type"])
+            for address in device["addresses"]
+        ]
+
+
+_network_manager = NetworkManagerMonitor()
+
+
+@timed
+async def check_local_ip():
+    ips = await _network_manager.local_ips()
+    return ips if ips else await asyncio.to_thread(check_local_ip_fallback)
 
 
+@timed
 async def network_info():
     return {
         "hostname": get_hostname(),
-        "external_ip": check_external_ip(get_ttl_hash(60)),
+        "external_ip": await check_external_ip(),
         "local_ip": await check_local_ip(),
     }
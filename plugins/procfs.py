@@ -0,0 +1,116 @@
+import math
+import os
+import re
+
+PROC_ROOT = "/proc"
+SYS_ROOT = "/sys"
+
+# Pseudo filesystems `df` would list but which never hold user data
+PSEUDO_FILESYSTEMS = {
+    "devtmpfs",
+    "efivarfs",
+    "overlay",
+    "ramfs",
+    "squashfs",
+    "tmpfs",
+}
+
+
+def format_size(size, binary=True):
+    """Format bytes the way `free -h` (binary) or `df -h` does"""
+    units = ["B", "K", "M", "G", "T", "P"]
+    value = float(size)
+    unit = 0
+    while value >= 1024 and unit < len(units) - 1:
+        value /= 1024
+        unit += 1
+
+    if unit == 0:
+        return f"{int(value)}B" if binary else f"{int(value)}"
+
+    label = units[unit] + ("i" if binary else "")
+    if not binary:
+        # df rounds sizes up rather than to the nearest value
+        value = math.ceil(value * 10) / 10 if value < 10 else math.ceil(value)
+    if value < 10:
+        return f"{value:.1f}{label}"
+    return f"{value:.0f}{label}"
+
+
+def format_uptime(seconds):
+    """Format seconds the way `uptime -p` does"""
+    minutes = int(seconds // 60)
+    parts = []
+    for name, size in (
+        ("year", 525600),
+        ("week", 10080),
+        ("day", 1440),
+        ("hour", 60),
+        ("minute", 1),
+    ):
+        value, minutes = divmod(minutes, size)
+        if value:
+            parts.append(f"{value} {name}{'' if value == 1 else 's'}")
+
+    return "up " + ", ".join(parts or ["0 minutes"])
+
+
+def read_uptime():
+    with open(f"{PROC_ROOT}/uptime", "r") as f:
+        return float(f.read().split()[0])
+
+
+def read_process_age(pid="self"):
+    """Seconds since process `pid` started, to the kernel's clock tick"""
+    with open(f"{PROC_ROOT}/{pid}/stat", "r") as f:
+        # The command name may contain spaces, so split after it
+        fields = f.read().rpartition(")")[2].split()
+    started = int(fields[19]) / os.sysconf("SC_CLK_TCK")
+    return read_uptime() - started
+
+
+def read_meminfo():
+    """Return /proc/meminfo values in bytes"""
+    meminfo = {}
+    with open(f"{PROC_ROOT}/meminfo", "r") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            parts = value.split()
+            if not parts:
+                continue
+            amount = int(parts[0])
+            if len(parts) > 1 and parts[1] == "kB":
+                amount *= 1024
+            meminfo[key] = amount
+    return meminfo
+
+
+def _unescape_mount_field(value):
+    return re.sub(r"\\([0-7]{3})", lambda m: chr(int(m.group(1), 8)), value)
+
+
+def read_mounts():
+    """Return (device, mount point, filesystem type) for every mount"""
+    mounts = []
+    with open(f"{PROC_ROOT}/mounts", "r") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) < 3:
+                continue
+            mounts.append(
+                (
+                    _unescape_mount_field(parts[0]),
+                    _unescape_mount_field(parts[1]),
+                    parts[2],
+                )
+            )
+    return mounts
+
+
+def disk_usage(mount):
+    """Return (size, used, available) in bytes, computed like `df` does"""
+    stat = os.statvfs(mount)
+    size = stat.f_blocks * stat.f_frsize
+    used = (stat.f_blocks - stat.f_bfree) * stat.f_frsize
+    available = stat.f_bavail * stat.f_frsize
+    return size, used, available
@@ -1,18 +1,27 @@
-from async_lru import alru_cache
 from microdot import Microdot, Request
-from tinydb import TinyDB
+from .storage import database
 from .utils import get_bus
+from .fleet import FleetClient, get_monitored_hostnames
+from .concurrency import SingleFlight, run_blocking
 from pydantic import BaseModel, Field
-from .utils import get_ttl_hash
-import aiohttp
+from fnmatch import fnmatchcase
+from functools import partial
 import asyncio
-from random import random
+import time
 
 
-async def fetch_data(session, url):
-    async with session.get(url) as response:
-        data = await response.json()
-        return data if response.status == 200 else []
+# Seconds between attempts to reach systemd after a failure
+RETRY_INTERVAL = 30
+UNIT_PROPERTIES = {
+    "ActiveState": "state",
+    "SubState": "sub_state",
+    "Description": "description",
+}
+UNIT_PROPERTIES_MATCH = (
+    "type='signal',sender='org.freedesktop.systemd1',"
+    "interface='org.freedesktop.DBus.Properties',member='PropertiesChanged',"
+    "arg0='org.freedesktop.systemd1.Unit'"
+)
 
 
 class ServiceInput(BaseModel):
@@ -20,9 +29,160 @@ class ServiceInput(BaseModel):
     host: str = Field(..., min_length=3)
 
 
+class SystemdUnits:
+    """Table of systemd services, kept in memory
+
+    Units are listed once with ListUnitsByPatterns and then kept current from
+    the manager's UnitNew/UnitRemoved signals and the units' PropertiesChanged
+    signals.
+    """
+
+    bus_name = "org.freedesktop.systemd1"
+    path = "/org/freedesktop/systemd1"
+    pattern = "*.service"
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.tasks = set()
+        self.failed_at = None
+        self.reset()
+
+    def reset(self):
+        self.bus = None
+        self.manager = None
+        self.units = {}
+        self.paths = {}
+        self.ready = False
+
+    def schedule(self, coroutine):
+        task = asyncio.create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def store(self, raw_unit):
+        name, description, _, active_state, sub_state, _, path, *_ = raw_unit
+        self.units[name] = {
+            "name": name,
+            "state": active_state,
+            "sub_state": sub_state,
+            "description": description,
+        }
+        self.paths[path] = name
+
+    async def connect(self):
+        bus = await get_bus()
+        if bus is None:
+            self.reset()
+            return False
+        if bus is not self.bus:
+            self.reset()
+            self.bus = bus
+        if self.ready:
+            return True
+        if self.failed_at and time.monotonic() - self.failed_at < RETRY_INTERVAL:
+            return False
+
+        # get_bus() has loaded dbus_fast by now
+        from dbus_fast import Message
+        from dbus_fast.errors import DBusError
+
+        async with self.lock:
+            if self.ready:
+                return True
+            try:
+                introspection = await bus.introspect(self.bus_name, self.path)
+                systemd = bus.get_proxy_object(self.bus_name, self.path, introspection)
+                self.manager = systemd.get_interface("org.freedesktop.systemd1.Manager")
+                self.manager.on_unit_new(self.unit_new)
+                self.manager.on_unit_removed(self.unit_removed)
+                await bus.call(
+                    Message(
+                        destination="org.freedesktop.DBus",
+                        path="/org/freedesktop/DBus",
+                        interface="org.freedesktop.DBus",
+                        member="AddMatch",
+                        signature="s",
+                        body=[UNIT_PROPERTIES_MATCH],
+                    )
+                )
+                bus.add_message_handler(self.properties_changed)
+                # systemd only emits unit signals to subscribed clients
+                await self.manager.call_subscribe()
+
+                try:
+                    raw_units = await self.manager.call_list_units_by_patterns(
+                        [], [self.pattern]
+                    )
+                except (DBusError, AttributeError):
+                    # systemd older than 230
+                    raw_units = [
+                        unit
+                        for unit in await self.manager.call_list_units()
+                        if fnmatchcase(unit[0], self.pattern)
+                    ]
+            except Exception as e:
+                print(f"Could not list systemd units: {e}")
+                bus.remove_message_handler(self.properties_changed)
+                self.reset()
+                self.bus = bus
+                self.failed_at = time.monotonic()
+                return False
+
+            for raw_unit in raw_units:
+                self.store(raw_unit)
+            self.ready = True
+            self.failed_at = None
+        return True
+
+    def unit_new(self, name: str, path: str):
+        if fnmatchcase(name, self.pattern):
+            self.schedule(self.load_unit(name))
+
+    def unit_removed(self, name: str, path: str):
+        self.units.pop(name, None)
+        self.paths.pop(path, None)
+
+    async def load_unit(self, name: str):
+        if self.manager is None:
+            return
+        try:
+            raw_units = await self.manager.call_list_units_by_names([name])
+        except Exception as e:
+            print(f"Could not load systemd unit {name}: {e}")
+            return
+        for raw_unit in raw_units:
+            self.store(raw_unit)
+
+    def properties_changed(self, message):
+        if message.member != "PropertiesChanged" or message.path not in self.paths:
+            return
+        interface, changed, invalidated = message.body
+        if interface != "org.freedesktop.systemd1.Unit":
+            return
+
+        unit = self.units.get(self.paths[message.path])
+        if unit is None:
+            return
+        for property, field in UNIT_PROPERTIES.items():
+            if property in changed:
+                unit[field] = changed[property].value
+        if any(property in invalidated for property in UNIT_PROPERTIES):
+            self.schedule(self.load_unit(unit["name"]))
+
+    async def get_units(self):
+        if not await self.connect():
+            return None
+        return list(self.units.values())
+
+
 class ServicePlugin:
     def __init__(self, app: Microdot):
         self.app = app
+        self.units = SystemdUnits()
+        self.flight = SingleFlight()
+        self.fleet = FleetClient(
+            "/api/services", ttl=60.0, stale_ttl=900.0, refresh_ahead=15.0
+        )
         app.get("/api/services")(self.get_services)
         app.get("/api/services/all")(self.handle_get_all_services)
         app.get("/api/services/pinned")(self.get_pinned_services)
@@ -31,77 +191,59 @@ class ServicePlugin:
 
     async def handle_get_all_services(self, request: Request):
         bust = request.args.get("bust", "false").lower() == "true"
-        return await self.get_all_services(
-            cache_key=random() if bust else get_ttl_hash(300)
-        )
+        details = request.args.get("details", "false").lower() == "true"
+        hosts = await self.get_all_services(refresh=bust)
 
-    @alru_cache(maxsize=1)
-    async def get_all_services(self, cache_key: int):
-        services = []
-        monitored_hosts = []
-        with TinyDB("data/db.json") as db:
-            monitored_hosts = db.table("monitored_devices").all()
-
-        async with aiohttp.ClientSession() as session:
-            urls = []
-            for host in monitored_hosts:
-                host_address = host.get("hostname")
-                urls.append(f"http://{host_address}/api/services")
-
-            tasks = [fetch_data(session, url) for url in urls]
-            results = await asyncio.gather(*tasks)
-
-            for result, index in zip(results, range(len(results))):
-                for service in result:
-                    services.append(
-                        {**service, "host": monitored_hosts[index].get("hostname")}
-                    )
+        services = [
+            {**service, "host": host["hostname"]}
+            for host in hosts
+            if isinstance(host["data"], list)
+            for service in host["data"]
+        ]
+        if not details:
+            return services
 
-            return services, 200
+        return {
+            "services": services,
+            "hosts": [
+                {key: value for key, value in host.items() if key != "data"}
+                for host in hosts
+            ],
+        }
 
-    async def get_services(self, cache_key: int):
-        bus = await get_bus()
-        if not bus:
-            return []
+    async def get_all_services(self, refresh=False):
+        return await self.flight.run(
+            ("services", refresh), partial(self.fetch_all_services, refresh)
+        )
 
-        try:
-            introspection = await bus.introspect(
-                "org.freedesktop.systemd1", "/org/freedesktop/systemd1"
-            )
-            systemd = bus.get_proxy_object(
-                "org.freedesktop.systemd1", "/org/freedesktop/systemd1", introspection
-            )
-            manager = systemd.get_interface("org.freedesktop.systemd1.Manager")
-            raw_units = await manager.call_list_units()
-        except Exception:
-            return []
+    async def fetch_all_services(self, refresh: bool):
+        hostnames = await run_blocking(get_monitored_hostnames)
+        return await self.fleet.get_all(hostnames, refresh)
 
-        units = []
-        for unit in raw_units:
-            name, description, _, active_state, sub_state, *_ = unit
-            if not name.endswith(".service"):
-                continue
-
-            units.append(
-                {
-                    "name": name,
-                    "state": active_state,
-                    "sub_state": sub_state,
-                    "description": description,
-                }
-            )
+    async def get_services(self, request: Request):
+        units = await self.units.get_units()
+        if units is None:
+            return []
 
+        states = request.args.get("state")
+        pattern = request.args.get("pattern")
+        if states:
+            states = set(states.split(","))
+            units = [
+                unit
+                for unit in units
+                if unit["state"] in states or unit["sub_state"] in states
+            ]
+        if pattern:
+            units = [unit for unit in units if fnmatchcase(unit["name"], pattern)]
         return units
 
     def pin_service(self, request: Request):
         service_input = ServiceInput(**request.json)
 
-        with TinyDB("data/db.json") as db:
+        with database() as db:
             table = db.table("pinned_services")
-            existing = table.search(
-                lambda x: x.get("name") == service_input.name
-                and x.get("host") == service_input.host
-            )
+            existing = table.find(name=service_input.name, host=service_input.host)
             if not existing:
                 table.insert({"name": service_input.name, "host": service_input.host})
 
@@ -110,15 +252,13 @@ class ServicePlugin:
     def unpin_service(self, request: Request):
         service_input = ServiceInput(**request.json)
 
-        with TinyDB("data/db.json") as db:
+        with database() as db:
             table = db.table("pinned_services")
-            table.remove(
-                lambda x: x.get("name") == service_input.name
-                and x.get("host") == service_input.host
-            )
+            existing = table.find(name=service_input.name, host=service_input.host)
+            table.remove(doc_ids=[service.doc_id for service in existing])
         return "", 204
 
     def get_pinned_services(self, request: Request):
-        with TinyDB("data/db.json") as db:
+        with database() as db:
             pinned = db.table("pinned_services").all()
             return pinned, 200
@@ -0,0 +1,103 @@
+import asyncio
+
+
+def diff(before, after, path=()):
+    """Return the changes turning `before` into `after`
+
+    The patch holds the new and changed keys, nested like the payload, with
+    None kept as a real value; removed keys are listed separately as paths.
+    """
+    patch = {}
+    removed = [[*path, key] for key in before.keys() - after.keys()]
+    for key, value in after.items():
+        if key not in before:
+            patch[key] = value
+        elif before[key] != value:
+            if isinstance(value, dict) and isinstance(before[key], dict):
+                child_patch, child_removed = diff(before[key], value, (*path, key))
+                if child_patch:
+                    patch[key] = child_patch
+                removed += child_removed
+            else:
+                patch[key] = value
+    return patch, removed
+
+
+class Subscriber:
+    def __init__(self, max_pending: int):
+        self.queue = asyncio.Queue(maxsize=max_pending)
+        self.synced = False
+
+    def send(self, event: str, data):
+        try:
+            self.queue.put_nowait((event, data))
+        except asyncio.QueueFull:
+            # The client fell behind, so drop the backlog and let it catch
+            # up from a full snapshot on the next tick
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.synced = False
+
+
+class StatusStream:
+    """Share one collection pass per tick between all stream subscribers
+
+    Every subscriber starts from a full snapshot and then receives deltas
+    with only the fields that changed since the previous tick: a nested
+    `patch` of new values and the `removed` key paths.
+    """
+
+    def __init__(self, collect, interval=5.0, max_pending=10):
+        self.collect = collect
+        self.interval = interval
+        self.max_pending = max_pending
+        self.subscribers: set[Subscriber] = set()
+        self.snapshot = None
+        self.task = None
+
+    async def _run(self):
+        try:
+            while self.subscribers:
+                try:
+                    await self.tick()
+                except Exception as e:
+                    # Subscribers keep the last state and get the next tick
+                    print(f"Could not collect status: {e!r}")
+                await asyncio.sleep(self.interval)
+        finally:
+            self.snapshot = None
+            self.task = None
+
+    async def tick(self):
+        snapshot = await self.collect()
+        delta = None
+        if self.snapshot is not None:
+            patch, removed = diff(self.snapshot, snapshot)
+            if patch or removed:
+                delta = {"patch": patch, "removed": removed}
+        self.snapshot = snapshot
+
+        for subscriber in list(self.subscribers):
+            if not subscriber.synced:
+                subscriber.synced = True
+                subscriber.send("snapshot", snapshot)
+            elif delta:
+                subscriber.send("delta", delta)
+            else:
+                subscriber.send("ping", None)
+
+    async def subscribe(self):
+        subscriber = Subscriber(self.max_pending)
+        if self.snapshot is not None:
+            subscriber.synced = True
+            subscriber.send("snapshot", self.snapshot)
+
+        self.subscribers.add(subscriber)
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+        try:
+            while True:
+                yield await subscriber.queue.get()
+        finally:
+            self.subscribers.discard(subscriber)
@@ -0,0 +1,376 @@
+import atexit
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+from contextlib import contextmanager
+from tinydb import TinyDB, Query
+from tinydb.storages import Storage
+from tinydb.table import Document, Table
+
+DATA_DIR = os.getenv("DATA_DIR", "data")
+DB_PATH = os.path.join(DATA_DIR, "db.json")
+SQLITE_PATH = os.path.join(DATA_DIR, "db.sqlite3")
+DB_BACKEND = os.getenv("DB_BACKEND", "tinydb").lower()
+
+# Fields looked up or sorted on, indexed by the SQLite backend; a True flag
+# makes the index unique
+INDEXES = {
+    "geocoding": [(("key",), True)],
+    "links": [(("order",), False)],
+    "meta": [(("key",), True)],
+    "monitored_devices": [(("hostname",), False)],
+    "pinned_services": [(("host", "name"), True)],
+    "todos": [(("revision",), False)],
+}
+
+_db = None
+_lock = threading.RLock()
+
+
+class BufferedJSONStorage(Storage):
+    """TinyDB storage that keeps the database in memory
+
+    The file is read once; writes only mark the data dirty and are flushed
+    `flush_delay` seconds later, coalescing bursts of writes into one. The
+    file is replaced atomically so a crash never leaves it half written.
+    """
+
+    def __init__(self, path: str, flush_delay=1.0, retry_delay=10.0):
+        self.path = path
+        self.flush_delay = flush_delay
+        self.retry_delay = retry_delay
+        self.dirty = False
+        self.timer = None
+        self.write_lock = threading.Lock()
+        self.data = None
+
+        try:
+            with open(path, "r") as f:
+                content = f.read()
+            if content.strip():
+                self.data = json.loads(content)
+        except FileNotFoundError:
+            pass
+
+    def read(self):
+        return self.data
+
+    def _schedule(self, delay: float):
+        # Called with _lock held
+        if self.timer is None:
+            self.timer = threading.Timer(delay, self.flush)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def write(self, data):
+        with _lock:
+            self.data = data
+            self.dirty = True
+            self._schedule(self.flush_delay)
+
+    def flush(self):
+        with _lock:
+            self.timer = None
+            if not self.dirty:
+                return
+            content = json.dumps(self.data)
+            # Writes made while the file is being written mark it dirty again
+            self.dirty = False
+
+        try:
+            self._write_file(content)
+        except OSError as e:
+            print(f"Could not write {self.path}, retrying: {e}")
+            with _lock:
+                self.dirty = True
+                self._schedule(self.retry_delay)
+
+    def _write_file(self, content: str):
+        with self.write_lock:
+            directory = os.path.dirname(self.path) or "."
+            try:
+                mode = os.stat(self.path).st_mode & 0o777
+            except FileNotFoundError:
+                mode = 0o644
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".db-", suffix=".tmp")
+            try:
+                os.fchmod(fd, mode)
+                with os.fdopen(fd, "w") as f:
+                    f.write(content)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+
+    def close(self):
+        with _lock:
+            if self.timer is not None:
+                self.timer.cancel()
+        self.flush()
+
+
+def _sort_key(field: str):
+    # Mirror SQLite, which sorts missing values first
+    return lambda document: (field in document, document.get(field))
+
+
+class DocumentTable(Table):
+    """TinyDB table with the query helpers the SQLite backend implements"""
+
+    def all(self, order_by=None, descending=False, limit=None):
+        documents = super().all()
+        if order_by is not None:
+            documents.sort(key=_sort_key(order_by), reverse=descending)
+        return documents if limit is None else documents[:limit]
+
+    def find(self, **fields):
+        return self.search(Query().fragment(fields))
+
+    def after(self, field: str, value, limit=None):
+        """Documents whose `field` is greater than `value`, in its order"""
+        documents = self.search(Query()[field] > value)
+        documents.sort(key=_sort_key(field))
+        return documents if limit is None else documents[:limit]
+
+
+class DocumentDB(TinyDB):
+    table_class = DocumentTable
+
+    @contextmanager
+    def transaction(self):
+        yield self
+
+    def flush(self):
+        self.storage.flush()
+
+
+def _check_name(name: str):
+    if not re.fullmatch(r"[A-Za-z_][A-Za-z0-9_]*", name):
+        raise ValueError(f"Invalid table or field name: {name}")
+    return name
+
+
+def _field(name: str):
+    return f"json_extract(data, '$.{_check_name(name)}')"
+
+
+class SQLiteTable:
+    """Document table stored in SQLite, with the DocumentTable interface"""
+
+    def __init__(self, connection: sqlite3.Connection, name: str):
+        self.connection = connection
+        self.name = _check_name(name)
+
+        connection.execute(
+            f'CREATE TABLE IF NOT EXISTS "{name}" '
+            "(id INTEGER PRIMARY KEY AUTOINCREMENT, data TEXT NOT NULL)"
+        )
+        for fields, unique in INDEXES.get(name, []):
+            index_name = "_".join((name, *fields))
+            connection.execute(
+                f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS "
+                f'"{index_name}" ON "{name}" '
+                f"({', '.join(_field(field) for field in fields)})"
+            )
+
+    def _documents(self, rows):
+        return [Document(json.loads(data), doc_id=doc_id) for doc_id, data in rows]
+
+    def all(self, order_by=None, descending=False, limit=None):
+        query = f'SELECT id, data FROM "{self.name}"'
+        if order_by is not None:
+            query += f" ORDER BY {_field(order_by)} {'DESC' if descending else 'ASC'}"
+        if limit is not None:
+            query += f" LIMIT {int(limit)}"
+        return self._documents(self.connection.execute(query))
+
+    def find(self, **fields):
+        # A None value matches a stored null, not a missing field, as in TinyDB
+        conditions = [
+            (
+                f"json_type(data, '$.{_check_name(field)}') = 'null'"
+                if value is None
+                else f"{_field(field)} = ?"
+            )
+            for field, value in fields.items()
+        ]
+        values = [value for value in fields.values() if value is not None]
+        return self._documents(
+            self.connection.execute(
+                f'SELECT id, data FROM "{self.name}" WHERE ' + " AND ".join(conditions),
+                values,
+            )
+        )
+
+    def after(self, field: str, value, limit=None):
+        query = (
+            f'SELECT id, data FROM "{self.name}" WHERE {_field(field)} > ? '
+            f"ORDER BY {_field(field)}"
+        )
+        if limit is not None:
+            query += f" LIMIT {int(limit)}"
+        return self._documents(self.connection.execute(query, (value,)))
+
+    def get(self, doc_id: int):
+        row = self.connection.execute(
+            f'SELECT id, data FROM "{self.name}" WHERE id = ?', (doc_id,)
+        ).fetchone()
+        return self._documents([row])[0] if row else None
+
+    def insert(self, document: dict):
+        if isinstance(document, Document):
+            cursor = self.connection.execute(
+                f'INSERT INTO "{self.name}" (id, data) VALUES (?, ?)',
+                (document.doc_id, json.dumps(document)),
+            )
+        else:
+            cursor = self.connection.execute(
+                f'INSERT INTO "{self.name}" (data) VALUES (?)',
+                (json.dumps(document),),
+            )
+        return cursor.lastrowid
+
+    def insert_multiple(self, documents):
+        return [self.insert(document) for document in documents]
+
+    def update(self, fields: dict, doc_ids):
+        updated = []
+        for document in self._documents(
+            self.connection.execute(
+                f'SELECT id, data FROM "{self.name}" WHERE id IN '
+                f"({', '.join('?' for _ in doc_ids)})",
+                list(doc_ids),
+            )
+        ):
+            document.update(fields)
+            self.connection.execute(
+                f'UPDATE "{self.name}" SET data = ? WHERE id = ?',
+                (json.dumps(document), document.doc_id),
+            )
+            updated.append(document.doc_id)
+        return updated
+
+    def remove(self, doc_ids):
+        doc_ids = list(doc_ids)
+        self.connection.execute(
+            f'DELETE FROM "{self.name}" WHERE id IN '
+            f"({', '.join('?' for _ in doc_ids)})",
+            doc_ids,
+        )
+        return doc_ids
+
+    def __len__(self):
+        return self.connection.execute(
+            f'SELECT COUNT(*) FROM "{self.name}"'
+        ).fetchone()[0]
+
+
+class SQLiteDB:
+    """SQLite (WAL) database exposing TinyDB-like tables
+
+    Each `with database()` block runs as one transaction. On first start the
+    existing db.json is imported once, keeping document ids.
+    """
+
+    def __init__(self, path: str, import_path: str | None = None):
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS _meta (key TEXT PRIMARY KEY, value TEXT)"
+        )
+        self.tables: dict[str, SQLiteTable] = {}
+        self.depth = 0
+
+        if import_path:
+            with self.transaction():
+                self._import_json(import_path)
+
+    def _import_json(self, path: str):
+        imported = self.connection.execute(
+            "SELECT value FROM _meta WHERE key = 'imported_from'"
+        ).fetchone()
+        if imported or not os.path.exists(path):
+            return
+
+        storage = BufferedJSONStorage(path)
+        for name, documents in (storage.read() or {}).items():
+            table = self.table(name)
+            for doc_id, document in documents.items():
+                table.insert(Document(document, doc_id=int(doc_id)))
+        self.connection.execute(
+            "INSERT INTO _meta (key, value) VALUES ('imported_from', ?)", (path,)
+        )
+        print(f"Imported {path} into SQLite")
+
+    def table(self, name: str):
+        if name not in self.tables:
+            self.tables[name] = SQLiteTable(self.connection, name)
+        return self.tables[name]
+
+    @contextmanager
+    def transaction(self):
+        self.depth += 1
+        try:
+            yield self
+            if self.depth == 1:
+                self.connection.commit()
+        except BaseException:
+            if self.depth == 1:
+                self.connection.rollback()
+            raise
+        finally:
+            self.depth -= 1
+
+    def flush(self):
+        pass
+
+
+def open_database():
+    os.makedirs(DATA_DIR, exist_ok=True)
+    if DB_BACKEND == "sqlite":
+        return SQLiteDB(SQLITE_PATH, import_path=DB_PATH)
+    return DocumentDB(DB_PATH, storage=BufferedJSONStorage)
+
+
+@contextmanager
+def database():
+    """Yield the shared database, holding the database lock
+
+    Everything done inside one `with database()` block is atomic for other
+    threads, so keep network calls and other slow work outside of it.
+    """
+    global _db
+    with _lock:
+        if _db is None:
+            _db = open_database()
+        with _db.transaction():
+            yield _db
+
+
+def flush_database():
+    if _db is not None:
+        _db.flush()
+
+
+def get_meta(db, key: str, default=None):
+    """Read a value stored next to the data it describes"""
+    documents = db.table("meta").find(key=key)
+    return documents[0]["value"] if documents else default
+
+
+def set_meta(db, key: str, value):
+    table = db.table("meta")
+    documents = table.find(key=key)
+    if documents:
+        table.update({"value": value}, doc_ids=[documents[0].doc_id])
+    else:
+        table.insert({"key": key, "value": value})
+
+
+atexit.register(flush_database)
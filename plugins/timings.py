@@ -0,0 +1,289 @@
+import asyncio
+import cProfile
+import heapq
+import os
+import random
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+from inspect import iscoroutinefunction
+from microdot import Microdot, Request, Response
+from . import procfs
+from .storage import DATA_DIR
+
+# Upper bounds of the latency buckets in seconds; slower calls land in an
+# overflow bucket
+BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", 0))
+PROFILE_DIR = os.path.join(DATA_DIR, "profiles")
+PROFILE_KEEP = 10
+
+_lock = threading.Lock()
+
+
+class Histogram:
+    __slots__ = ("counts", "count", "total", "max", "errors")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.errors = 0
+
+    def observe(self, seconds: float, error=False):
+        with _lock:
+            self.counts[bisect_left(BUCKETS, seconds)] += 1
+            self.count += 1
+            self.total += seconds
+            if seconds > self.max:
+                self.max = seconds
+            if error:
+                self.errors += 1
+
+    def percentile(self, q: float):
+        """Estimate a percentile by interpolating inside its bucket"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            if bucket_count and seen + bucket_count >= rank:
+                if index == len(BUCKETS):
+                    return self.max
+                lower = BUCKETS[index - 1] if index else 0.0
+                upper = min(BUCKETS[index], self.max)
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.max
+
+    def summary(self):
+        def ms(seconds):
+            return None if seconds is None else round(seconds * 1000, 3)
+
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "mean_ms": ms(self.total / self.count) if self.count else None,
+            "p50_ms": ms(self.percentile(0.5)),
+            "p95_ms": ms(self.percentile(0.95)),
+            "p99_ms": ms(self.percentile(0.99)),
+            "max_ms": ms(self.max),
+        }
+
+
+histograms: dict[str, Histogram] = {}
+counters: dict[str, dict[str, int]] = {}
+
+
+def observe(name: str, seconds: float, error=False):
+    histogram = histograms.get(name)
+    if histogram is None:
+        histogram = histograms.setdefault(name, Histogram())
+    histogram.observe(seconds, error)
+
+
+def count(name: str, event: str):
+    with _lock:
+        events = counters.setdefault(name, {})
+        events[event] = events.get(event, 0) + 1
+
+
+def timed(func):
+    """Record the latency and failures of every call of `func`"""
+    name = f"{func.__module__.rsplit('.', 1)[-1]}.{func.__qualname__}"
+
+    if iscoroutinefunction(func):
+
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            error = True
+            try:
+                result = await func(*args, **kwargs)
+                error = False
+                return result
+            finally:
+                observe(name, time.perf_counter() - started, error)
+
+    else:
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            error = True
+            try:
+                result = func(*args, **kwargs)
+                error = False
+                return result
+            finally:
+                observe(name, time.perf_counter() - started, error)
+
+    return wrapper
+
+
+class StartupReport:
+    """Time spent in each startup phase, up to the first response served
+
+    The first phase covers the interpreter start and the imports done before
+    this module, measured from the process start time in /proc.
+    """
+
+    def __init__(self):
+        self.phases: dict[str, float] = {}
+        try:
+            self.phases["interpreter"] = procfs.read_process_age()
+        except (OSError, ValueError, IndexError):
+            pass
+        self.last = time.perf_counter()
+        self.first_response = None
+
+    def mark(self, phase: str):
+        """Close the phase that started at the previous mark"""
+        now = time.perf_counter()
+        self.phases[phase] = now - self.last
+        self.last = now
+
+    def responded(self):
+        if self.first_response is not None:
+            return
+        self.mark("until_first_response")
+        self.first_response = sum(self.phases.values())
+        phases = ", ".join(
+            f"{phase} {seconds * 1000:.0f}ms" for phase, seconds in self.phases.items()
+        )
+        print(f"Startup: {phases}; first response {self.first_response * 1000:.0f}ms")
+
+    def summary(self):
+        return {
+            "phases_ms": {
+                phase: round(seconds * 1000, 1)
+                for phase, seconds in self.phases.items()
+            },
+            "first_response_ms": (
+                None
+                if self.first_response is None
+                else round(self.first_response * 1000, 1)
+            ),
+        }
+
+
+startup = StartupReport()
+
+
+class TimingsPlugin:
+    """Per-route and per-collector latency, served at /api/debug/timings
+
+    With PROFILE_SAMPLE_RATE set, that fraction of requests is run under
+    cProfile and the PROFILE_KEEP slowest are kept in DATA_DIR/profiles.
+    cProfile only sees the event loop thread, and one request is profiled
+    at a time.
+    """
+
+    def __init__(self, app: Microdot):
+        self.app = app
+        self.routes = {}
+        self.profile = None
+        self.profiles = []
+        self.profiles_lock = threading.Lock()
+        app.get("/api/debug/timings")(self.get_timings)
+
+    def install(self):
+        """Start timing requests; call once all routes are registered"""
+        for methods, pattern, handler, _, _ in self.app.url_map:
+            self.routes[handler] = f"{','.join(methods)} {pattern.url_pattern}"
+        self.app.before_request(self.start_request)
+        self.app.after_request(self.finish_request)
+        self.app.after_error_request(self.finish_request)
+
+    async def start_request(self, request: Request):
+        request.g.started = time.perf_counter()
+        if (
+            PROFILE_SAMPLE_RATE
+            and self.profile is None
+            and random.random() < PROFILE_SAMPLE_RATE
+        ):
+            self.profile = request.g.profile = cProfile.Profile()
+            self.profile.enable()
+
+    async def finish_request(self, request: Request, response: Response):
+        started = getattr(request.g, "started", None)
+        if started is None:
+            return
+        duration = time.perf_counter() - started
+        route = self.routes.get(request.route, "other")
+        observe(f"route.{route}", duration, response.status_code >= 500)
+        startup.responded()
+
+        profile = getattr(request.g, "profile", None)
+        if profile is not None:
+            profile.disable()
+            self.profile = None
+            await asyncio.to_thread(self.keep_profile, profile, route, duration)
+
+    def keep_profile(self, profile: cProfile.Profile, route: str, duration: float):
+        with self.profiles_lock:
+            self._keep_profile(profile, route, duration)
+
+    def _keep_profile(self, profile: cProfile.Profile, route: str, duration: float):
+        if len(self.profiles) >= PROFILE_KEEP and duration <= self.profiles[0][0]:
+            return
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        slug = "".join(c if c.isalnum() else "_" for c in route).strip("_")
+        path = os.path.join(
+            PROFILE_DIR, f"{int(time.time())}-{round(duration * 1000)}ms-{slug}.prof"
+        )
+        profile.dump_stats(path)
+        heapq.heappush(self.profiles, (duration, path))
+        if len(self.profiles) > PROFILE_KEEP:
+            _, removed = heapq.heappop(self.profiles)
+            try:
+                os.remove(removed)
+            except FileNotFoundError:
+                pass
+
+    async def monitor_loop_lag(self, interval=0.5):
+        """Record how late the event loop wakes up from a sleep"""
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(interval)
+            observe("loop.lag", max(time.perf_counter() - started - interval, 0.0))
+
+    async def get_timings(self, request: Request):
+        """`?buckets=true` adds the raw bucket counts, so a client polling
+        the endpoint can compute percentiles over its own intervals"""
+        buckets = request.args.get("buckets", "false").lower() == "true"
+        timings = {}
+        for name in sorted(histograms):
+            timings[name] = histograms[name].summary()
+            if buckets:
+                timings[name]["total_ms"] = histograms[name].total * 1000
+                timings[name]["counts"] = list(histograms[name].counts)
+
+        result = {
+            "startup": startup.summary(),
+            "timings": timings,
+            "counters": {name: dict(counters[name]) for name in sorted(counters)},
+            "profiles": [os.path.basename(path) for _, path in sorted(self.profiles)],
+        }
+        if buckets:
+            result["buckets_ms"] = [bound * 1000 for bound in BUCKETS]
+        return result
@@ -1,60 +1,218 @@
+import asyncio
 from microdot import Microdot, Request
 from pydantic import BaseModel, Field
-from tinydb import TinyDB
-from datetime import datetime
+from .concurrency import run_blocking
+from .storage import database, get_meta, set_meta
+from datetime import datetime, timedelta
+
+DEFAULT_PAGE_SIZE = 200
+MAX_PAGE_SIZE = 1000
+# Deleted todos are kept this long for clients to sync the deletion
+TOMBSTONE_RETENTION = timedelta(days=30)
 
 
 class TodoInput(BaseModel):
     content: str = Field(..., min_length=1)
 
 
+class TodoUpdateInput(TodoInput):
+    id: int = Field(..., ge=0)
+
+
+class TodoBulkInput(BaseModel):
+    create: list[TodoInput] = Field(default_factory=list)
+    update: list[TodoUpdateInput] = Field(default_factory=list)
+    delete: list[int] = Field(default_factory=list)
+
+
+def serialize_todo(todo):
+    return {"id": todo.doc_id, **todo}
+
+
 class TodoListPlugin:
+    """Todos with a revision number per change
+
+    Every write takes the next revision, and deleted todos are kept as
+    tombstones, so `?since=<cursor>` can return just what changed. Tombstones
+    older than TOMBSTONE_RETENTION are removed; a cursor from before the last
+    removed one gets `reset` and has to sync again from 0.
+    """
+
     def __init__(self, app: Microdot):
         self.app = app
         app.get("/api/todos")(self.get_todos)
         app.put("/api/todos")(self.put_todo)
+        app.post("/api/todos/bulk")(self.bulk_todos)
         app.patch("/api/todos/<id>")(self.patch_todo)
         app.delete("/api/todos/<id>")(self.delete_todo)
 
+    def next_revision(self, db, count=1):
+        """Reserve `count` revisions and return the first of them"""
+        revision = get_meta(db, "todo_revision")
+        if revision is None:
+            last = db.table("todos").all(order_by="revision", descending=True, limit=1)
+            revision = (last[0].get("revision") or 0) if last else 0
+        set_meta(db, "todo_revision", revision + count)
+        return revision + 1
+
+    def compact(self):
+        """Remove tombstones older than TOMBSTONE_RETENTION"""
+        expired = (datetime.now() - TOMBSTONE_RETENTION).isoformat()
+        with database() as db:
+            todos_table = db.table("todos")
+            tombstones = [
+                todo
+                for todo in todos_table.find(deleted=True)
+                if todo["updated_at"] < expired
+            ]
+            if not tombstones:
+                return
+            todos_table.remove(doc_ids=[todo.doc_id for todo in tombstones])
+            horizon = max(todo["revision"] for todo in tombstones)
+            set_meta(
+                db,
+                "todo_compacted",
+                max(horizon, get_meta(db, "todo_compacted", 0)),
+            )
+
+    async def run(self, interval=3600.0):
+        while True:
+            await run_blocking(self.compact)
+            await asyncio.sleep(interval)
+
     def get_todos(self, request: Request):
-        with TinyDB("data/db.json") as db:
-            todos = db.table("todos").all()
-            return [{"id": todo.doc_id, **todo} for todo in todos]
+        since = request.args.get("since")
+        if since is None:
+            with database() as db:
+                todos = db.table("todos").all()
+                return [
+                    serialize_todo(todo) for todo in todos if not todo.get("deleted")
+                ]
+
+        try:
+            since = int(since)
+            limit = int(request.args.get("limit", DEFAULT_PAGE_SIZE))
+        except ValueError:
+            return {"error": "Invalid cursor or limit"}, 400
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+        with database() as db:
+            if 0 < since < get_meta(db, "todo_compacted", 0):
+                return {"todos": [], "cursor": 0, "more": True, "reset": True}
+            # One extra row tells whether another page follows
+            changes = db.table("todos").after("revision", since, limit=limit + 1)
+
+        page = changes[:limit]
+        return {
+            "todos": [serialize_todo(todo) for todo in page],
+            "cursor": page[-1]["revision"] if page else since,
+            "more": len(changes) > limit,
+        }
 
     def put_todo(self, request: Request):
-        with TinyDB("data/db.json") as db:
+        with database() as db:
             todos_table = db.table("todos")
             data = request.json
             todo_input = TodoInput(**data)
+            now = datetime.now().isoformat()
             todos_table.insert(
                 {
                     **todo_input.model_dump(mode="json"),
-                    "created_at": datetime.now().isoformat(),
+                    "created_at": now,
+                    "updated_at": now,
+                    "revision": self.next_revision(db),
                 }
             )
             return "", 204
 
     def patch_todo(self, request: Request, id: str):
-        with TinyDB("data/db.json") as db:
+        with database() as db:
             todos_table = db.table("todos")
             data = request.json
             todo_input = TodoInput(**data)
             todo = todos_table.get(doc_id=int(id))
 
-            if not todo:
+            if not todo or todo.get("deleted"):
                 return {"error": "Todo not found"}, 404
 
             todos_table.update(
                 {
                     **todo_input.model_dump(mode="json"),
-                    "created_at": todo["created_at"],
+                    "updated_at": datetime.now().isoformat(),
+                    "revision": self.next_revision(db),
                 },
                 doc_ids=[todo.doc_id],
             )
             return "", 204
 
     def delete_todo(self, request: Request, id: str):
-        with TinyDB("data/db.json") as db:
+        with database() as db:
             todos_table = db.table("todos")
-            todos_table.remove(doc_ids=[int(id)])
+            todo = todos_table.get(doc_id=int(id))
+            if todo and not todo.get("deleted"):
+                todos_table.update(
+                    {
+                        "deleted": True,
+                        "content": "",
+                        "updated_at": datetime.now().isoformat(),
+                        "revision": self.next_revision(db),
+                    },
+                    doc_ids=[todo.doc_id],
+                )
             return "", 204
+
+    def bulk_todos(self, request: Request):
+        """Create, update and delete many todos in one write"""
+        bulk_input = TodoBulkInput(**request.json)
+
+        with database() as db:
+            todos_table = db.table("todos")
+            ids = [todo.id for todo in bulk_input.update] + bulk_input.delete
+            missing = [
+                id
+                for id in ids
+                if (todo := todos_table.get(doc_id=id)) is None or todo.get("deleted")
+            ]
+            if missing:
+                return {"error": "Todo not found", "ids": missing}, 404
+
+            deleted = list(dict.fromkeys(bulk_input.delete))
+            revision = self.next_revision(
+                db, len(bulk_input.create) + len(bulk_input.update) + len(deleted)
+            )
+            now = datetime.now().isoformat()
+            created = todos_table.insert_multiple(
+                {
+                    **todo_input.model_dump(mode="json"),
+                    "created_at": now,
+                    "updated_at": now,
+                    "revision": revision + index,
+                }
+                for index, todo_input in enumerate(bulk_input.create)
+            )
+            revision += len(created)
+
+            for todo_input in bulk_input.update:
+                todos_table.update(
+                    {
+                        "content": todo_input.content,
+                        "updated_at": now,
+                        "revision": revision,
+                    },
+                    doc_ids=[todo_input.id],
+                )
+                revision += 1
+
+            for id in deleted:
+                todos_table.update(
+                    {
+                        "deleted": True,
+                        "content": "",
+                        "updated_at": now,
+                        "revision": revision,
+                    },
+                    doc_ids=[id],
+                )
+                revision += 1
+
+            return {"created": created, "cursor": revision - 1}
@@ -1,22 +1,35 @@
-import time
-from dbus_fast.aio import MessageBus
-from dbus_fast import BusType
-
-
-def get_ttl_hash(seconds=3600):
-    """Return the same value withing `seconds` time period"""
-    return round(time.time() / seconds)
+import os
 
+# Where the system bus listens unless DBUS_SYSTEM_BUS_ADDRESS says otherwise
+SYSTEM_BUS_SOCKETS = [
+    "/run/dbus/system_bus_socket",
+    "/var/run/dbus/system_bus_socket",
+]
 
 _bus = None
 _bus_tried = False
 
 
+def system_bus_available():
+    """Whether a system bus may be reachable, checked without loading dbus_fast"""
+    return bool(os.getenv("DBUS_SYSTEM_BUS_ADDRESS")) or any(
+        os.path.exists(path) for path in SYSTEM_BUS_SOCKETS
+    )
+
+
 async def get_bus():
     global _bus
     global _bus_tried
 
     if _bus is None and not _bus_tried:
+        if not system_bus_available():
+            _bus_tried = True
+            return None
+
+        # Imported here so hosts without D-Bus never load it
+        from dbus_fast.aio import MessageBus
+        from dbus_fast import BusType
+
         try:
             _bus = await MessageBus(bus_type=BusType.SYSTEM).connect()
         except Exception as e:
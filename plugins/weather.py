@@ -1,12 +1,25 @@
 from microdot import Microdot, Request
-from tinydb import TinyDB, where
+from .storage import database
 from pydantic import BaseModel, Field
-import requests
+import aiohttp
+import asyncio
 import os
-from functools import lru_cache
-from .utils import get_ttl_hash
+from functools import partial
+from .cache import AsyncTTLCache
+from .concurrency import SingleFlight, run_blocking
+from .http_client import get_session
+from . import timings
 from dataclasses import dataclass, asdict
 
+OPENWEATHERMAP_URL = os.getenv(
+    "OPENWEATHERMAP_URL", "http://api.openweathermap.org"
+).rstrip("/")
+GEOCODING_CONCURRENCY = 4
+
+
+def normalize_city_name(name: str):
+    return " ".join(name.split()).casefold()
+
 
 @dataclass
 class City:
@@ -22,24 +35,42 @@ class CityInput(BaseModel):
     name: str = Field(..., min_length=2)
 
 
+class CityBulkInput(BaseModel):
+    names: list[str] = Field(..., min_length=1, max_length=100)
+
+
 class WeatherPlugin:
     def __init__(self, app: Microdot):
         self.app = app
         self.key = os.getenv("OPENWEATHERMAP_API_KEY")
+        # Entries stay fresh for 10 minutes, are refreshed during the last two
+        # and are served for up to an hour more if OpenWeatherMap is down
+        self.cache = AsyncTTLCache(
+            ttl=600, stale_ttl=3600, maxsize=256, refresh_ahead=120, name="weather"
+        )
+        self.flight = SingleFlight()
 
         app.get("/api/weather")(self.get_weather)
         if self.key:
             app.put("/api/weather")(self.put_city)
+            app.put("/api/weather/bulk")(self.put_cities)
             app.delete("/api/weather/<id>")(self.delete_city)
 
-    @lru_cache()
-    def fetch_weather(self, lat: float, lon: float, cache_key=None):
-        url = f"http://api.openweathermap.org/data/2.5/weather?lat={lat}&lon={lon}&appid={self.key}&units=metric"
-        response = requests.get(url)
-        return response.json()
+    async def fetch_weather(self, lat: float, lon: float):
+        async with get_session().get(
+            f"{OPENWEATHERMAP_URL}/data/2.5/weather",
+            params={"lat": lat, "lon": lon, "appid": self.key, "units": "metric"},
+            timeout=aiohttp.ClientTimeout(total=5),
+        ) as response:
+            response.raise_for_status()
+            return await response.json()
 
-    def get_weather_for_city(self, city: City):
-        data = self.fetch_weather(city.lat, city.lon, get_ttl_hash(600))
+    async def fetch_cached_weather(self, city: City):
+        return await self.cache.get(
+            (city.lat, city.lon), partial(self.fetch_weather, city.lat, city.lon)
+        )
+
+    def get_weather_for_city(self, city: City, data: dict):
         return {
             "city": city.name,
             "country": city.country,
@@ -50,50 +81,192 @@ class WeatherPlugin:
             "description": data["weather"][0]["description"],
         }
 
-    def get_weather(self, request: Request):
+    def get_cities(self):
+        with database() as db:
+            cities = db.table("weather_cities").all()
+
+        result = []
+        for city in cities:
+            city_input = City(**city)
+            city_input.id = city.doc_id
+            result.append(city_input)
+        return result
+
+    async def run(self, interval=60.0):
+        """Refresh weather for every city before its cache entry expires"""
+        if not self.key:
+            return
+
+        while True:
+            cities = await run_blocking(self.get_cities)
+            await asyncio.gather(
+                *(self.fetch_cached_weather(city) for city in cities),
+                return_exceptions=True,
+            )
+            await asyncio.sleep(interval)
+
+    async def get_weather(self, request: Request):
         if not self.key:
             return []
+        return await self.flight.run("weather", self.collect_weather)
 
-        with TinyDB("data/db.json") as db:
-            cities = db.table("weather_cities").all()
-            weather_data = []
-            for city in cities:
-                city_input = City(**city)
-                city_input.id = city.doc_id
-                weather = self.get_weather_for_city(city_input)
-                weather_data.append(weather)
+    async def collect_weather(self):
+        cities = await run_blocking(self.get_cities)
+        results = await asyncio.gather(
+            *(self.fetch_cached_weather(city) for city in cities),
+            return_exceptions=True,
+        )
+
+        weather_data = []
+        for city, result in zip(cities, results):
+            # Cities the upstream has never answered for are left out until
+            # a later refresh succeeds
+            if isinstance(result, Exception):
+                continue
+            try:
+                weather_data.append(self.get_weather_for_city(city, result.value))
+            except (KeyError, IndexError, TypeError):
+                continue
+
+        return weather_data
+
+    async def geocode(self, name: str):
+        async with get_session().get(
+            f"{OPENWEATHERMAP_URL}/geo/1.0/direct",
+            params={"q": name, "limit": 1, "appid": self.key},
+            timeout=aiohttp.ClientTimeout(total=5),
+        ) as response:
+            response.raise_for_status()
+            results = await response.json()
+
+        if not results:
+            return None
+        city_data = results[0]
+        return City(
+            name=city_data["name"],
+            country=city_data["country"],
+            state=city_data.get("state"),
+            lat=city_data["lat"],
+            lon=city_data["lon"],
+            id=None,
+        )
+
+    async def resolve_cities(self, names: list[str]):
+        """Resolve city names to coordinates, using the geocoding cache first
 
-            return weather_data
+        Returns a City, None (not found) or the lookup error for every name,
+        and the newly geocoded cities to add to the cache.
+        """
+        keys = [normalize_city_name(name) for name in names]
+        with database() as db:
+            geocoding_table = db.table("geocoding")
+            cached = {}
+            for key in set(keys):
+                for entry in geocoding_table.find(key=key):
+                    cached[key] = City(**entry["city"])
+
+        semaphore = asyncio.Semaphore(GEOCODING_CONCURRENCY)
+
+        async def lookup(name: str):
+            async with semaphore:
+                return await self.geocode(name)
+
+        missing = {key: name for key, name in zip(keys, names) if key not in cached}
+        for key in keys:
+            timings.count("cache.geocoding", "misses" if key in missing else "hits")
+        results = await asyncio.gather(
+            *(lookup(name) for name in missing.values()), return_exceptions=True
+        )
+        for result in results:
+            # Only lookup errors are returned, cancellation is not one
+            if isinstance(result, BaseException) and not isinstance(result, Exception):
+                raise result
+        geocoded = {
+            key: result
+            for key, result in zip(missing, results)
+            if not isinstance(result, Exception)
+        }
+        errors = {
+            key: result
+            for key, result in zip(missing, results)
+            if isinstance(result, Exception)
+        }
+
+        resolved = []
+        for key in keys:
+            if key in errors:
+                resolved.append(errors[key])
+            else:
+                resolved.append(cached.get(key) or geocoded.get(key))
+        return resolved, {key: city for key, city in geocoded.items() if city}
+
+    def save_cities(self, cities: list[City], geocoded: dict[str, City]):
+        """Store new cities and geocoding results in one write
+
+        Cities already stored, or repeated in `cities`, are skipped. Returns
+        the cities that were added.
+        """
+        with database() as db:
+            geocoding_table = db.table("geocoding")
+            for key, city in geocoded.items():
+                # Also cache the canonical name so adding it later is a hit
+                for alias in {key, normalize_city_name(city.name)}:
+                    if not geocoding_table.find(key=alias):
+                        geocoding_table.insert({"key": alias, "city": asdict(city)})
 
-    def put_city(self, request: Request):
-        with TinyDB("data/db.json") as db:
             cities_table = db.table("weather_cities")
-            data = request.json
-
-            city_input = CityInput(name=data["name"])
-
-            url = f"http://api.openweathermap.org/geo/1.0/direct?q={city_input.name}&limit=1&appid={self.key}"
-            response = requests.get(url)
-            if response.status_code != 200 or not response.json():
-                return "Could not find city", 404
-
-            city_data = response.json()[0]
-            city = City(
-                name=city_data["name"],
-                country=city_data["country"],
-                state=city_data.get("state"),
-                lat=city_data["lat"],
-                lon=city_data["lon"],
-                id=None,
-            )
+            stored = {(city["lat"], city["lon"]) for city in cities_table.all()}
+            added = []
+            for city in cities:
+                if (city.lat, city.lon) not in stored:
+                    stored.add((city.lat, city.lon))
+                    added.append(city)
+            cities_table.insert_multiple(asdict(city) for city in added)
+            return added
 
-            cities_table.insert(
-                asdict(city),
-            )
-            return "", 204
+    async def put_city(self, request: Request):
+        data = request.json
+        city_input = CityInput(name=data["name"])
+
+        (city,), geocoded = await self.resolve_cities([city_input.name])
+        if isinstance(city, Exception):
+            return {"error": "Could not reach OpenWeatherMap"}, 502
+        if city is None:
+            return "Could not find city", 404
+
+        self.save_cities([city], geocoded)
+        return "", 204
+
+    async def put_cities(self, request: Request):
+        bulk_input = CityBulkInput(**request.json)
+        unique = {}
+        for name in bulk_input.names:
+            unique.setdefault(normalize_city_name(name), CityInput(name=name).name)
+        names = list(unique.values())
+
+        resolved, geocoded = await self.resolve_cities(names)
+        added = self.save_cities(
+            [city for city in resolved if isinstance(city, City)], geocoded
+        )
+        added_ids = {id(city) for city in added}
+
+        return {
+            "added": [city.name for city in added],
+            "existing": [
+                name
+                for name, city in zip(names, resolved)
+                if isinstance(city, City) and id(city) not in added_ids
+            ],
+            "not_found": [name for name, city in zip(names, resolved) if city is None],
+            "failed": [
+                name
+                for name, city in zip(names, resolved)
+                if isinstance(city, Exception)
+            ],
+        }
 
     def delete_city(self, request: Request, id: str):
-        with TinyDB("data/db.json") as db:
+        with database() as db:
             cities_table = db.table("weather_cities")
             cities_table.remove(doc_ids=[int(id)])
             return "", 204
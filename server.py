@@ -1,15 +1,22 @@
-from microdot import Microdot, Response, Request, send_file
+from microdot import Microdot, Response, Request
 from microdot.cors import CORS
+from microdot.sse import with_sse
+import asyncio
 import os
 from dotenv import load_dotenv
 from pydantic import ValidationError
 
+from plugins.timings import startup
 from migrations.migrate import run_migrations
 
 run_migrations()
+startup.mark("migrations")
 
 
-from plugins.hardware import hardware_info
+from plugins.hardware import hardware_info, sample_cpu_usage
+from plugins.history import MetricsHistoryPlugin
+from plugins.metrics import MetricsPlugin
+from plugins.timings import TimingsPlugin
 from plugins.monitored_devices import MonitoredDevicesPlugin
 from plugins.network import network_info
 from plugins.docker import DockerPlugin
@@ -17,7 +24,14 @@ from plugins.todo import TodoListPlugin
 from plugins.weather import WeatherPlugin
 from plugins.links import LinkPlugin
 from plugins.service import ServicePlugin
+from plugins.status_stream import StatusStream
+from plugins.fleet import FleetStatusPlugin
+from plugins.http_client import close_session
+from plugins.storage import flush_database
+from plugins.concurrency import SingleFlight, run_blocking
+from plugins import concurrency, http_cache
 
+startup.mark("imports")
 
 load_dotenv()
 
@@ -27,6 +41,8 @@ Response.default_content_type = "application/json"
 app = Microdot()
 cors = CORS(allowed_origins="*")
 cors.initialize(app=app)
+http_cache.install(app)
+static_files = http_cache.StaticFiles()
 
 
 @app.errorhandler(ValidationError)
@@ -40,20 +56,59 @@ todo_list = TodoListPlugin(app)
 weather = WeatherPlugin(app)
 links = LinkPlugin(app)
 monitored_devices = MonitoredDevicesPlugin(app)
+history = MetricsHistoryPlugin(app)
+metrics = MetricsPlugin(app, docker, services)
+timings = TimingsPlugin(app)
 
 
-@app.get("/api/status")
-async def get_payload(request: Request):
+status_flight = SingleFlight()
+
+
+async def gather_status():
+    hardware, network = await asyncio.gather(
+        run_blocking(hardware_info),
+        network_info(),
+    )
     return {
         "docker": docker.get_containers(),
-        "hardware": hardware_info(),
-        "network": await network_info(),
+        "hardware": hardware,
+        "network": network,
     }
 
 
+async def collect_status():
+    # Concurrent requests and the stream share one collection
+    return await status_flight.run("status", gather_status)
+
+
+status_stream = StatusStream(collect_status)
+fleet_status = FleetStatusPlugin(app, collect_status)
+startup.mark("plugins")
+
+
+@app.get("/api/status")
+async def get_payload(request: Request):
+    return await collect_status()
+
+
+@app.get("/api/status/stream")
+@with_sse
+async def stream_payload(request: Request, sse):
+    async for event, data in status_stream.subscribe():
+        # microdot buffers sends without a limit, so hold the next event back
+        # until the writer took the previous one; a slow client then fills
+        # its bounded subscriber queue and gets resynced from a snapshot
+        while sse.queue:
+            await asyncio.sleep(0.1)
+        if event == "ping":
+            await sse.send(event, comment=True)
+        else:
+            await sse.send(data, event=event)
+
+
 @app.get("/")
 def index(request: Request):
-    return send_file("public/index.html")
+    return static_files.response(request, "public/index.html")
 
 
 @app.get("/favicon.ico")
@@ -66,12 +121,36 @@ def public_files(request: Request, path: str):
     if ".." in path:
         return "Not found", 404
     try:
-        return send_file(path)
-    except FileNotFoundError:
+        return static_files.response(request, path)
+    except (FileNotFoundError, IsADirectoryError):
         return "Not found", 404
 
 
-app.run(
-    debug=debug,
-    port=int(os.environ.get("PORT", 18745)),
-)
+async def main():
+    background_tasks = [
+        asyncio.create_task(sample_cpu_usage()),
+        asyncio.create_task(history.run()),
+        asyncio.create_task(docker.run()),
+        asyncio.create_task(docker.sample_stats()),
+        asyncio.create_task(weather.run()),
+        asyncio.create_task(links.run()),
+        asyncio.create_task(todo_list.run()),
+        asyncio.create_task(metrics.run()),
+        asyncio.create_task(timings.monitor_loop_lag()),
+    ]
+    concurrency.install(app)
+    timings.install()
+    startup.mark("tasks")
+    try:
+        await app.start_server(
+            debug=debug,
+            port=int(os.environ.get("PORT", 18745)),
+        )
+    finally:
+        for task in background_tasks:
+            task.cancel()
+        await close_session()
+        flush_database()
+
+
+asyncio.run(main())
@@ -1,5 +1,6 @@
 import { useMutation, useQuery, useQueryClient } from "@tanstack/react-query";
 import { callApi } from "./client";
+import { API_HOST } from "./config.";
 
 export type Link = {
   name: string;
@@ -10,6 +11,11 @@ export type Link = {
 
 export type PutLink = Omit<Link, "id">;
 
+// Icons cached by the server are returned as paths relative to its API
+export function getIconUrl(icon: string) {
+  return icon.startsWith("/api/") ? `http://${API_HOST}${icon}` : icon;
+}
+
 export function createLinksOptions() {
   return {
     queryKey: ["links"],
@@ -1,10 +1,21 @@
 import { useQuery } from "@tanstack/react-query";
 
+export type DockerContainerStats = {
+  cpu_percent: number | null;
+  memory_usage: number;
+  memory_limit: number | null;
+  network_rx_rate: number | null;
+  network_tx_rate: number | null;
+  block_read_rate: number | null;
+  block_write_rate: number | null;
+};
+
 export type DockerContainerStatus = {
   id: string;
   name: string;
   running: boolean;
   image: string;
+  stats: DockerContainerStats | null;
 };
 
 export type HardwareStatus = {
@@ -13,6 +24,12 @@ export type HardwareStatus = {
     [key: `core${number}`]: number;
   };
   ram: [string, string, string];
+  ram_bytes: {
+    total: number;
+    used: number;
+    free: number;
+    available: number;
+  } | null;
   disk: Record<
     string,
     {
@@ -21,10 +38,14 @@ export type HardwareStatus = {
       percent: string;
       size: string;
       used: string;
+      available_bytes: number;
+      size_bytes: number;
+      used_bytes: number;
     }
   >;
   temperature: string;
   uptime: string;
+  uptime_seconds: number | null;
 };
 
 export type LocalIP = {
@@ -1,17 +1,64 @@
 import { useMutation, useQuery, useQueryClient } from "@tanstack/react-query";
 import { callApi } from "./client";
 
+type TodoResponse = {
+  id: number;
+  content: string;
+  created_at: string;
+  updated_at: string;
+  revision: number;
+  deleted?: boolean;
+};
+
+type TodoChanges = {
+  todos: TodoResponse[];
+  cursor: number;
+  more: boolean;
+  // The cursor is older than the deletions the server still remembers
+  reset?: boolean;
+};
+
+// Todos seen so far per host, so each refetch only asks for what changed
+const todoSync = new Map<
+  string,
+  { cursor: number; todos: Map<number, TodoResponse> }
+>();
+
+async function syncTodos(hostname: string) {
+  const state = todoSync.get(hostname) ?? { cursor: 0, todos: new Map() };
+  todoSync.set(hostname, state);
+
+  let more = true;
+  while (more) {
+    const changes = await callApi<TodoChanges>(`todos?since=${state.cursor}`, {
+      host: hostname,
+    });
+    if (changes.reset) {
+      state.todos.clear();
+    }
+    changes.todos.forEach((todo) => {
+      if (todo.deleted) {
+        state.todos.delete(todo.id);
+      } else {
+        state.todos.set(todo.id, todo);
+      }
+    });
+    state.cursor = changes.cursor;
+    more = changes.more;
+  }
+
+  return [...state.todos.values()]
+    .sort((a, b) => a.id - b.id)
+    .map((todo) => ({
+      ...todo,
+      created_at: new Date(todo.created_at).getTime(),
+    }));
+}
+
 export function createTodosOptions(hostname: string) {
   return {
     queryKey: ["todos", hostname],
-    queryFn: () =>
-      callApi("todos").then(
-        (res: { id: number; content: string; created_at: string }[]) =>
-          res.map((todo) => ({
-            ...todo,
-            created_at: new Date(todo.created_at).getTime(),
-          })),
-      ),
+    queryFn: () => syncTodos(hostname),
   };
 }
 
@@ -7,6 +7,7 @@ import {
 } from "@/components/ui/item";
 import React from "react";
 import {
+  getIconUrl,
   Link,
   PutLink,
   useDeleteLink,
@@ -161,7 +162,7 @@ function Link({
         )}
         <ItemMedia>
           <img
-            src={icon ? icon : urlJoin(url, "favicon.ico")}
+            src={icon ? getIconUrl(icon) : urlJoin(url, "favicon.ico")}
             alt="Favicon"
             className="h-4 w-4"
           />
@@ -0,0 +1,37 @@
+import os
+import tempfile
+from types import SimpleNamespace
+
+# The plugins read DATA_DIR on import, so point it away from data/ first
+os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="home-dashboard-test-")
+
+import pytest
+from microdot import Microdot
+from plugins import storage
+
+
+@pytest.fixture(params=["tinydb", "sqlite"])
+def db(request, tmp_path, monkeypatch):
+    """A fresh database of each backend, also returned by `database()`"""
+    if request.param == "sqlite":
+        instance = storage.SQLiteDB(str(tmp_path / "db.sqlite3"))
+    else:
+        instance = storage.DocumentDB(
+            str(tmp_path / "db.json"), storage=storage.BufferedJSONStorage
+        )
+    monkeypatch.setattr(storage, "_db", instance)
+    yield instance
+    if isinstance(instance, storage.SQLiteDB):
+        instance.connection.close()
+    else:
+        instance.close()
+
+
+@pytest.fixture
+def app():
+    return Microdot()
+
+
+def make_request(args: dict | None = None, json=None):
+    """The parts of a microdot Request the handlers read"""
+    return SimpleNamespace(args=args or {}, json=json)
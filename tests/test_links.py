@@ -0,0 +1,63 @@
+import pytest
+from plugins.links import RANK_GAP, LinkPlugin
+from plugins.storage import database
+from conftest import make_request
+
+
+@pytest.fixture
+def links(db, app):
+    plugin = LinkPlugin(app)
+    db.table("links").insert_multiple(
+        {"name": name, "url": f"https://{name}.example", "order": rank}
+        for name, rank in zip("abcd", range(RANK_GAP, 5 * RANK_GAP, RANK_GAP))
+    )
+    return plugin
+
+
+def names():
+    with database() as db:
+        return "".join(link["name"] for link in db.table("links").all(order_by="order"))
+
+
+def move(plugin, id, index):
+    return plugin.reorder_links(make_request(json={"id": id, "index": index}))
+
+
+@pytest.mark.parametrize(
+    "id, index, expected",
+    [
+        (1, 3, "bcad"),  # forward, in front of d
+        (4, 0, "dabc"),  # backward, to the front
+        (2, 4, "acdb"),  # past the last link
+        (2, 10, "acdb"),  # index beyond the end
+        (3, 2, "abcd"),  # in front of itself
+    ],
+)
+def test_reorder_moves_one_link(links, id, index, expected):
+    assert move(links, id, index) == ("", 204)
+    assert names() == expected
+
+
+def test_reorder_unknown_link(links):
+    assert move(links, 99, 0)[1] == 404
+    assert names() == "abcd"
+
+
+def test_reorder_rebalances_when_ranks_run_out(links, db):
+    table = db.table("links")
+    for link in table.all():
+        table.update({"order": link.doc_id}, doc_ids=[link.doc_id])
+
+    move(links, 4, 1)
+
+    assert names() == "adbc"
+    assert [link["order"] for link in table.all(order_by="order")][-1] >= RANK_GAP
+
+
+def test_reorder_keeps_ranks_unique(links):
+    for id, index in [(1, 3), (3, 0), (4, 1), (2, 2), (1, 0)]:
+        move(links, id, index)
+
+    with database() as db:
+        ranks = [link["order"] for link in db.table("links").all()]
+    assert len(set(ranks)) == len(ranks)
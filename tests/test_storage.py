@@ -0,0 +1,98 @@
+import json
+import os
+from plugins import storage
+from plugins.storage import database, get_meta, set_meta
+
+
+def fill(db):
+    table = db.table("todos")
+    table.insert_multiple(
+        [
+            {"content": "b", "revision": 2, "deleted": False},
+            {"content": "a", "revision": 3, "deleted": True},
+            {"content": "c", "revision": 1, "deleted": False},
+            {"content": "d", "revision": 5, "note": None},
+        ]
+    )
+    return table
+
+
+def contents(documents):
+    return [document["content"] for document in documents]
+
+
+def test_all_orders_and_limits(db):
+    table = fill(db)
+
+    assert contents(table.all(order_by="revision")) == ["c", "b", "a", "d"]
+    assert contents(table.all(order_by="revision", descending=True, limit=2)) == [
+        "d",
+        "a",
+    ]
+    assert len(table.all()) == 4
+
+
+def test_find_matches_every_field(db):
+    table = fill(db)
+
+    assert contents(table.find(deleted=True)) == ["a"]
+    assert contents(table.find(deleted=False, revision=1)) == ["c"]
+    assert contents(table.find(note=None)) == ["d"]
+    assert table.find(content="missing") == []
+
+
+def test_after_returns_later_documents_in_order(db):
+    table = fill(db)
+
+    assert contents(table.after("revision", 1)) == ["b", "a", "d"]
+    assert contents(table.after("revision", 1, limit=2)) == ["b", "a"]
+    assert table.after("revision", 5) == []
+
+
+def test_documents_keep_their_ids(db):
+    table = db.table("links")
+    first, second = table.insert_multiple([{"name": "a"}, {"name": "b"}])
+
+    table.update({"name": "c"}, doc_ids=[second])
+    table.remove(doc_ids=[first])
+
+    assert table.get(doc_id=second) == {"name": "c"}
+    assert table.get(doc_id=first) is None
+    assert [document.doc_id for document in table.all()] == [second]
+
+
+def test_meta_values_round_trip(db):
+    with database() as current:
+        assert get_meta(current, "schema_version") is None
+        assert get_meta(current, "schema_version", "none") == "none"
+        set_meta(current, "schema_version", "a")
+        set_meta(current, "schema_version", "b")
+
+        assert get_meta(current, "schema_version") == "b"
+        assert len(current.table("meta").all()) == 1
+
+
+def test_failed_flush_stays_dirty_and_retries(tmp_path, monkeypatch):
+    path = str(tmp_path / "db.json")
+    buffered = storage.BufferedJSONStorage(path, flush_delay=60, retry_delay=0.01)
+    replace = os.replace
+    calls = []
+
+    def failing_replace(source, target):
+        calls.append(target)
+        if len(calls) == 1:
+            raise OSError("disk full")
+        replace(source, target)
+
+    monkeypatch.setattr(os, "replace", failing_replace)
+    buffered.write({"todos": {"1": {"content": "a"}}})
+    buffered.flush()
+
+    assert buffered.dirty
+    assert not os.path.exists(path)
+
+    buffered.timer.join(1)
+    assert not buffered.dirty
+    with open(path) as f:
+        assert json.load(f) == {"todos": {"1": {"content": "a"}}}
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
@@ -0,0 +1,93 @@
+from datetime import datetime, timedelta
+import pytest
+from plugins.storage import database, get_meta
+from plugins.todo import TOMBSTONE_RETENTION, TodoListPlugin
+from conftest import make_request
+
+
+@pytest.fixture
+def todos(db, app):
+    return TodoListPlugin(app)
+
+
+def since(plugin, cursor, limit=None):
+    args = {"since": str(cursor)}
+    if limit is not None:
+        args["limit"] = str(limit)
+    return plugin.get_todos(make_request(args))
+
+
+def test_since_returns_only_changes(todos):
+    todos.put_todo(make_request(json={"content": "a"}))
+    todos.put_todo(make_request(json={"content": "b"}))
+    cursor = since(todos, 0)["cursor"]
+
+    todos.patch_todo(make_request(json={"content": "a2"}), "1")
+    todos.delete_todo(make_request(), "2")
+    changes = since(todos, cursor)
+
+    assert [(todo["id"], todo["content"]) for todo in changes["todos"]] == [
+        (1, "a2"),
+        (2, ""),
+    ]
+    assert changes["todos"][1]["deleted"]
+    assert changes["cursor"] == 4
+    assert since(todos, changes["cursor"]) == {"todos": [], "cursor": 4, "more": False}
+    assert [todo["content"] for todo in todos.get_todos(make_request())] == ["a2"]
+
+
+def test_since_pages_through_changes(todos):
+    todos.bulk_todos(make_request(json={"create": [{"content": "x"}] * 5}))
+
+    first = since(todos, 0, limit=2)
+    second = since(todos, first["cursor"], limit=10)
+
+    assert len(first["todos"]) == 2 and first["more"]
+    assert len(second["todos"]) == 3 and not second["more"]
+
+
+def test_invalid_cursor(todos):
+    assert since(todos, "abc")[1] == 400
+
+
+def test_revision_counter_continues_from_existing_todos(todos, db):
+    db.table("todos").insert(
+        {"content": "old", "created_at": "", "updated_at": "", "revision": 7}
+    )
+
+    todos.put_todo(make_request(json={"content": "new"}))
+    result = todos.bulk_todos(
+        make_request(json={"create": [{"content": "x"}], "delete": [1, 1]})
+    )
+
+    assert result["cursor"] == 10
+    with database() as current:
+        assert get_meta(current, "todo_revision") == 10
+
+
+def test_compaction_resets_cursors_older_than_removed_tombstones(todos, db):
+    todos.bulk_todos(make_request(json={"create": [{"content": "x"}] * 3}))
+    todos.delete_todo(make_request(), "1")
+    todos.delete_todo(make_request(), "2")
+    old_cursor = 4
+    expired = (datetime.now() - TOMBSTONE_RETENTION - timedelta(days=1)).isoformat()
+    db.table("todos").update({"updated_at": expired}, doc_ids=[1])
+
+    todos.compact()
+
+    assert db.table("todos").get(doc_id=1) is None
+    assert db.table("todos").get(doc_id=2)["deleted"]
+    assert since(todos, 3) == {"todos": [], "cursor": 0, "more": True, "reset": True}
+    assert "reset" not in since(todos, old_cursor)
+    # A client starting over gets everything still stored
+    assert [todo["id"] for todo in since(todos, 0)["todos"]] == [3, 2]
+
+
+def test_compaction_keeps_recent_tombstones(todos, db):
+    todos.put_todo(make_request(json={"content": "x"}))
+    todos.delete_todo(make_request(), "1")
+
+    todos.compact()
+
+    assert db.table("todos").get(doc_id=1)["deleted"]
+    assert "reset" not in since(todos, 1)